@@ -1,121 +1,396 @@
-import time
-import os
+import argparse
+import hashlib
 import json
-from random import shuffle
+import os
+import re
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-from genanki import Note, Deck
-from anki_models import default_de_en_model, default_en_de_model, map_word_data_to_anki, WordData
-from oxford import Word, WordNotFound
-from gpt_translate import translate_en_to_de_with_definition
-from parser import NotesParser
+from metrics import metrics, profiled
+from anki_models import default_de_en_model, default_en_de_model, map_word_data_to_anki, \
+    validate_word_data, TEMPLATE_VERSION
+from oxford import Word, WordNotFound, Transport
+from gpt_translate import translate_definitions, AsyncTranslator, PROMPT_VERSION
+from data_store import VocabStore
+from deck_writer import write_deck, sub_deck_id
+from lexicon import Lexicon, dictionary_entry
+from media_store import MediaStore
+from page_cache import PageCache
+from parser import NotesParser, ParseManifest
+from pipeline import Pipeline
+from throttle import RateLimiter, AdaptiveRateLimiter
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory
 import logging
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 logger.setLevel(logging.DEBUG)
 
+DECK_ID = 1318074875
+DECK_NAME = "Books Vocabulary"
+# default bounds of the on-disk caches, room for the definitions and pages of tens of thousands of words
+TRANSLATION_CACHE_MAX_ENTRIES = 200_000
+PAGE_CACHE_MAX_BYTES = 1 << 30
+
 
 class AnkiDeckGenerator:
-    def __init__(self):
-        # create or load data json
-        if os.path.exists("data/data.json"):
-            with open("data/data.json", "r", encoding="utf8") as file:
-                self.data = json.load(file)
+    def __init__(self, max_workers=4, requests_per_second=1.0, page_cache=None, data_store=None, translator=None,
+                 lexicon=None, media_store=None, max_requests_per_second=None, translation_memory_threshold=0.8,
+                 translation_cache_max_entries=TRANSLATION_CACHE_MAX_ENTRIES):
+        self.max_workers = max_workers
+        # with max_requests_per_second, requests_per_second is only the starting rate and adapts to the responses
+        if max_requests_per_second is None:
+            rate_limiter = RateLimiter(requests_per_second)
         else:
-            self.data = {}
-            os.makedirs("data", exist_ok=True)
-            with open("data/data.json", "w") as file:
-                json.dump(self.data, file)
+            rate = min(requests_per_second, max_requests_per_second)
+            rate_limiter = AdaptiveRateLimiter(rate, min_rate=min(0.1, rate), max_rate=max_requests_per_second)
+        self.transport = Transport(pool_size=max_workers, rate_limiter=rate_limiter)
+        self.page_cache = page_cache if page_cache is not None else PageCache(max_bytes=PAGE_CACHE_MAX_BYTES)
+        # extracted entries; build it from the page cache with `python lexicon.py`, misses are added as fetched
+        self.lexicon = lexicon if lexicon is not None else Lexicon()
+        # pronunciation recordings, downloaded over the dictionary transport and bundled into the deck
+        self.media_store = media_store if media_store is not None else \
+            MediaStore(transport=self.transport, offline=self.page_cache.offline)
+        self._sibling_executor = ThreadPoolExecutor(max_workers=max_workers)
+        # words are loaded from the store on demand; an existing data/data.json is migrated on first use
+        self.data = data_store if data_store is not None else VocabStore()
+        # least recently used translations are evicted beyond translation_cache_max_entries, None keeps all of them
+        self.translation_cache = TranslationCache(version=PROMPT_VERSION, max_entries=translation_cache_max_entries)
+        # reuses the translation of a near-identical definition of the same word; 0 or None sends every definition
+        self.translation_memory = TranslationMemory(self.translation_cache, threshold=translation_memory_threshold) \
+            if translation_memory_threshold else None
+        # optional gpt_translate.AsyncTranslator; without one, translations go through the synchronous client
+        self.translator = translator
 
     @staticmethod
-    def scrape_dictionary(word: str = None, word_id: str = None):
+    def scrape_dictionary(word: str = None, word_id: str = None, transport: Transport = None,
+                          cache: PageCache = None, lexicon: Lexicon = None):
         if (word is None and word_id is None) or (word is not None and word_id is not None):
             raise ValueError("Exactly one of word or word_id must be provided.")
-        word_info = Word(word) if word else Word(word_id, by_id=True)
-        ipa = None
-        if word_info.pronunciations:
-            for pron in word_info.pronunciations:
-                if pron["prefix"] == "nAmE":
-                    ipa = pron["ipa"]
-                    break
-            else:
-                ipa = word_info.pronunciations[0]["ipa"]
-        definitions = word_info.definition_full
-        return {"ipa": ipa, "definitions": definitions, "word": word_info.name, "id": word_info.id,
-                "word_form": word_info.wordform}
+        if lexicon is not None:
+            # entries expire with the pages they were extracted from
+            entry = lexicon.get(word=word, word_id=word_id, max_age=cache.ttl if cache is not None else None)
+            if entry is not None:
+                return entry
+        word_info = Word(word, transport=transport, cache=cache) if word else \
+            Word(word_id, by_id=True, transport=transport, cache=cache)
+        entry = dictionary_entry(word_info)
+        if lexicon is not None:
+            fetched_at = cache.fetched_at(word_info.get_url(by_id=not word)) if cache is not None else None
+            lexicon.put(entry, word=word, word_id=word_id, fetched_at=fetched_at)
+        return entry
 
     def get_data_for_word_list(self, word_list):
         logger.info(f"Processing {len(word_list)} words...")
+        pending = []
         for word in word_list:
-            logger.info(f"Processing {word}...")
-            if word in self.data:
+            if self.is_known(word):
                 logger.info(f"Word {word} already in data.")
                 continue
-            time.sleep(1)
-            word_info = AnkiDeckGenerator.scrape_dictionary(word=word)
-            base_word = word_info["word"]
-            if base_word in self.data:
-                logger.info(f"Word {base_word} already in data.")
-                continue
-            word_data = {"ipa": word_info["ipa"]}
-            self.populate_definitions(word_info)
-            word_data["definitions"] = [{
+            pending.append(word)
+        # fetch concurrently, but consume results in input order so self.data is filled as before
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for word, word_infos in zip(pending, executor.map(self.scrape_word_family, pending)):
+                logger.info(f"Processing {word}...")
+                if word in self.data:
+                    logger.info(f"Word {word} already in data.")
+                    continue
+                base_word = word_infos[0]["word"]
+                if base_word in self.data:
+                    logger.info(f"Word {base_word} already in data.")
+                    continue
+                self.fetch_audio(*word_infos)
+                self.populate_definitions(*word_infos)
+                self.data[base_word] = self.build_word_data(word_infos)
+
+    def is_known(self, word):
+        """ whether word, or the headword it resolved to in an earlier lookup, is already stored """
+        if word in self.data:
+            return True
+        headword = self.data.resolve_alias(word)
+        return headword is not None and headword in self.data
+
+    @staticmethod
+    def build_word_data(word_infos):
+        """ combine the translated entries of one homograph family into the stored word data, validated """
+        word_data = {"ipa": word_infos[0]["ipa"], "audio": word_infos[0].get("audio"), "definitions": []}
+        for word_info in word_infos:
+            word_data["definitions"].append({
                 "id": word_info["id"],
                 "word_form": word_info["word_form"],
-                "definitions": word_info["definitions"]}]
-            if "_1" in word_info["id"]:
-                i = 2
-                word_info = AnkiDeckGenerator.scrape_dictionary(word_id=word_info["id"].replace("_1", f"_{i}"))
-                while word_info is not None and "_" in word_info["id"]:
-                    self.populate_definitions(word_info)
-                    word_data["definitions"].append({
-                        "id": word_info["id"],
-                        "word_form": word_info["word_form"],
-                        "definitions": word_info["definitions"]
-                    })
-                    try:
-                        word_info = AnkiDeckGenerator.scrape_dictionary(
-                            word_id=word_info["id"].replace(f"_{i}", f"_{i + 1}"))
-                        i += 1
-                    except WordNotFound:
-                        word_info = None
-            self.data[base_word] = word_data
-            with open("data/data.json", "w", encoding="utf8") as file:
-                json.dump(self.data, file, ensure_ascii=False)
+                "definitions": word_info["definitions"]
+            })
+        return validate_word_data(word_data)
+
+    def scrape_word_family(self, word):
+        """ fetch the entry for word and, for homographs (id ending in _1), all following entries """
+        word_info = self._scrape(word=word)
+        if word_info["word"] != word:
+            self.data.add_alias(word, word_info["word"], word_info["id"])
+        word_infos = [word_info]
+        if "_1" in word_info["id"] and word_info["word"] not in self.data:
+            i = 2
+            if word_info["homograph_ids"]:
+                # siblings listed in the related entries index are fetched in one parallel wave
+                word_infos += [info for info in self._sibling_executor.map(self._scrape_sibling,
+                                                                           word_info["homograph_ids"])
+                               if info is not None and "_" in info["id"]]
+                # the index may list only some of them; the ones after the highest listed are probed
+                i = max(self._homograph_number(word_id) for word_id in word_info["homograph_ids"]) + 1
+            while True:
+                try:
+                    word_info = self._scrape(word_id=word_infos[0]["id"].replace("_1", f"_{i}"))
+                except WordNotFound:
+                    break
+                if "_" not in word_info["id"]:
+                    break
+                word_infos.append(word_info)
+                i += 1
+        return word_infos
 
     @staticmethod
-    def populate_definitions(word_info):
-        for def_stack in word_info["definitions"]:
-            logger.info(f"\tTranslating {word_info["word"]} ({def_stack["namespace"]})...")
-            for definition in def_stack["definitions"]:
-                description = definition["description"]
-                logger.info(f"\t\tDefinition: {description}")
+    def _homograph_number(word_id):
+        """ 3 for "game_3", 1 for an id without a number """
+        match = re.search(r"_(\d+)$", word_id)
+        return int(match.group(1)) if match else 1
+
+    def _scrape(self, word=None, word_id=None):
+        return AnkiDeckGenerator.scrape_dictionary(word=word, word_id=word_id, transport=self.transport,
+                                                   cache=self.page_cache, lexicon=self.lexicon)
+
+    def _scrape_sibling(self, word_id):
+        try:
+            return self._scrape(word_id=word_id)
+        except WordNotFound:
+            logger.warning(f"Related entry {word_id} not found.")
+            return None
+
+    def fetch_audio(self, *word_infos):
+        """ store the recording of the pronunciation shown on the card (the first entry's) in the media store """
+        audio_url = word_infos[0].get("audio_url")
+        word_infos[0]["audio"] = self.media_store.fetch(audio_url) if audio_url else None
+
+    def populate_definitions(self, *word_infos):
+        """ translate every definition of the given words in as few requests as possible """
+        definitions, items = [], []
+        for word_info in word_infos:
+            for def_stack in word_info["definitions"]:
+                logger.info(f"\tTranslating {word_info["word"]} ({def_stack["namespace"]})...")
                 namespace = def_stack["namespace"] if def_stack["namespace"] != "__GLOBAL__" else ""
-                german_translation = translate_en_to_de_with_definition(word_info["word"], namespace, description)
-                logger.info(f"\t\tTranslation: {german_translation}")
-                definition["german_translation"] = german_translation
-
-    def generate_anki_deck(self):
-        deck = Deck(1318074875, "Books Vocabulary")
-        for word, word_data in self.data.items():
-            en_to_de, de_to_en = map_word_data_to_anki(word, WordData.model_validate(word_data))
-            note = Note(
-                model=default_en_de_model,
-                fields=en_to_de
-            )
-            deck.add_note(note)
-            note = Note(
-                model=default_de_en_model,
-                fields=de_to_en
-            )
-            deck.add_note(note)
-        shuffle(deck.notes)
-        deck.write_to_file("anki_deck.apkg")
+                for definition in def_stack["definitions"]:
+                    definitions.append(definition)
+                    items.append((word_info["word"], namespace, definition["description"]))
+        translate = self.translator.translate_definitions_sync if self.translator is not None else translate_definitions
+        if self.translation_memory is not None:
+            german_translations = self.translation_memory.translate(items, translate)
+        else:
+            german_translations = translate(items, cache=self.translation_cache)
+        for definition, german_translation in zip(definitions, german_translations):
+            logger.info(f"\t\tDefinition: {definition["description"]}")
+            logger.info(f"\t\tTranslation: {german_translation}")
+            definition["german_translation"] = german_translation
+        logger.info(f"\tTranslation cache: {self.translation_cache.stats}")
+        if self.translation_memory is not None:
+            logger.info(f"\tTranslation memory: {self.translation_memory.stats}")
+
+    def generate_anki_deck(self, path="anki_deck.apkg", shard_by=None, batch_size=1000, processes=None,
+                           manifest_path="data/parse_manifest.json"):
+        """
+        Streams the vocabulary into an .apkg; memory is bounded by batch_size, not by the number of words
+        :param shard_by: None for a single deck, or "word_form" / "source" (export file) to write one sub-deck per
+            value into <path>_<value>.apkg, in parallel across `processes`
+        :param manifest_path: ParseManifest telling which export each word came from, for shard_by="source"
+        :return: the written .apkg paths
+        """
+        with metrics.timer("deck_build_seconds"):
+            return self._generate_anki_deck(path, shard_by, batch_size, processes, manifest_path)
+
+    def _generate_anki_deck(self, path, shard_by, batch_size, processes, manifest_path):
+        if shard_by not in (None, "word_form", "source"):
+            raise ValueError(f"Cannot shard by {shard_by!r}.")
+        sources = self._word_sources(manifest_path) if shard_by == "source" else None
+        models = [default_en_de_model, default_de_en_model]
+        rendered = reused = 0
+        with tempfile.TemporaryDirectory() as spill_directory:
+            spills = {}
+            if shard_by is None:
+                # the single deck is written even when the store is empty
+                spills[""] = open(os.path.join(spill_directory, "0.jsonl"), "w", encoding="utf8")
+            rerendered = []
+            for word, raw_data, rendered_digest, rendered_fields in self.data.iter_with_rendered():
+                digest = hashlib.sha256(f"{TEMPLATE_VERSION}\0{word}\0{raw_data}".encode("utf8")).hexdigest()
+                data = json.loads(raw_data) if digest != rendered_digest or shard_by == "word_form" else None
+                if digest == rendered_digest:
+                    en_to_de, de_to_en = json.loads(rendered_fields)
+                    reused += 1
+                else:
+                    # only words whose data (or the templates) changed since the last build are rendered, straight
+                    # from the stored dicts: the data was validated when it was stored
+                    en_to_de, de_to_en = map_word_data_to_anki(word, data)
+                    rerendered.append((word, digest, json.dumps([en_to_de, de_to_en], ensure_ascii=False)))
+                    rendered += 1
+                    if len(rerendered) >= batch_size:
+                        self.data.put_rendered(rerendered)
+                        rerendered = []
+                shard = self._shard_of(shard_by, word, data, sources)
+                spill = spills.get(shard)
+                if spill is None:
+                    spill = spills[shard] = open(os.path.join(spill_directory, f"{len(spills)}.jsonl"), "w",
+                                                 encoding="utf8")
+                spill.write(json.dumps([0, en_to_de], ensure_ascii=False) + "\n")
+                spill.write(json.dumps([1, de_to_en], ensure_ascii=False) + "\n")
+            self.data.put_rendered(rerendered)
+            for spill in spills.values():
+                spill.close()
+            metrics.increment("deck_notes_rendered_total", rendered)
+            metrics.increment("deck_notes_reused_total", reused)
+            logger.info(f"Rendered {rendered} changed words, reused {reused}.")
+
+            paths = {"": path} if shard_by is None else self._shard_paths(path, spills)
+            jobs = [(spill.name,
+                     paths[shard],
+                     sub_deck_id(DECK_ID, shard),
+                     f"{DECK_NAME}::{shard}" if shard else DECK_NAME)
+                    for shard, spill in sorted(spills.items())]
+            write_args = [[models] * len(jobs), [self.media_store.directory] * len(jobs), [batch_size] * len(jobs)]
+            with metrics.timer("deck_write_seconds"):
+                if len(jobs) > 1 and processes != 1:
+                    with ProcessPoolExecutor(processes) as pool:
+                        results = list(pool.map(write_deck, *zip(*jobs), *write_args))
+                else:
+                    results = list(map(write_deck, *zip(*jobs), *write_args))
+        missing = sum(result[2] for result in results)
+        if missing:
+            logger.warning(f"{missing} referenced media files are missing from the store.")
+        return [result[0] for result in results]
+
+    @staticmethod
+    def _shard_of(shard_by, word, data, sources):
+        if shard_by == "word_form":
+            # form of the first entry
+            definitions = data["definitions"]
+            return definitions[0]["word_form"] or "other" if definitions else "other"
+        if shard_by == "source":
+            return sources.get(word, "other")
+        return ""
+
+    @staticmethod
+    def _shard_paths(path, shards):
+        """
+        <path>_<shard>.apkg for every shard, with characters that cannot go into a file name replaced; shards whose
+        names only differ in those characters ("a/b" and "a b") also get their sub-deck id, so no file is overwritten
+        """
+        root, extension = os.path.splitext(path)
+        names = {shard: re.sub(r'[^\w-]+', '_', shard) for shard in shards}
+        counts = Counter(names.values())
+        paths = {}
+        for shard, name in names.items():
+            if counts[name] > 1:
+                name = f"{name}_{sub_deck_id(DECK_ID, shard)}"
+            paths[shard] = f"{root}_{name}{extension}"
+        return paths
+
+    def _word_sources(self, manifest_path):
+        """ headword -> name of the first export (in path order) it was highlighted in """
+        sources = {}
+        for file_path, entry in sorted(ParseManifest(manifest_path).entries.items()):
+            source = os.path.splitext(os.path.basename(file_path))[0]
+            for word in entry["words"] or []:
+                headword = word if word in self.data else self.data.resolve_alias(word)
+                if headword is not None:
+                    sources.setdefault(headword, source)
+        return sources
+
+    def record_stats(self):
+        """ copy the component statistics that are kept outside the metrics registry into gauges """
+        for name, value in self.translation_cache.stats.items():
+            metrics.set_gauge(f"translation_cache_{name}", value)
+        if self.translation_memory is not None:
+            for name, value in self.translation_memory.stats.items():
+                metrics.set_gauge(f"translation_memory_{name}", value)
+        metrics.set_gauge("page_cache_bytes", self.page_cache.size_bytes())
+        metrics.set_gauge("page_cache_pages", len(self.page_cache))
+        metrics.set_gauge("media_files", len(self.media_store))
+        if self.translator is not None:
+            for name, value in self.translator.stats.items():
+                metrics.set_gauge(f"translator_{name}", value)
 
 
 if __name__ == "__main__":
-    vocab = NotesParser.parse_all_in_dir("raw_sources")
-    vocab = list(set(vocab))
-    generator = AnkiDeckGenerator()
-    generator.get_data_for_word_list(vocab)
-    generator.generate_anki_deck()
+    arg_parser = argparse.ArgumentParser(description="Generate an Anki deck from Kindle and Apple Books exports.")
+    arg_parser.add_argument("--sources", default="raw_sources", help="directory with the exported notes")
+    arg_parser.add_argument("--parse-processes", type=int, default=None,
+                            help="processes for parsing new or changed exports (default: one per CPU)")
+    arg_parser.add_argument("--scrape-workers", type=int, default=4)
+    arg_parser.add_argument("--translate-workers", type=int, default=2)
+    arg_parser.add_argument("--audio-workers", type=int, default=2,
+                            help="threads downloading pronunciation recordings")
+    arg_parser.add_argument("--requests-per-second", type=float, default=1.0,
+                            help="starting rate of requests to the dictionary website; raised while the site keeps "
+                                 "up and cut when it throttles or fails")
+    arg_parser.add_argument("--max-requests-per-second", type=float, default=20.0,
+                            help="ceiling for the adaptive rate; 0 keeps the rate fixed at --requests-per-second")
+    arg_parser.add_argument("--queue-size", type=int, default=32, help="capacity of the queues between stages")
+    arg_parser.add_argument("--oxford-url", default=Word.base_url,
+                            help="dictionary website to scrape, e.g. a local stand-in for load tests")
+    arg_parser.add_argument("--translate-concurrency", type=int, default=0,
+                            help="translate on the async client with this many requests in flight "
+                                 "(default: one blocking request per translate worker)")
+    arg_parser.add_argument("--openai-requests-per-minute", type=int, default=500)
+    arg_parser.add_argument("--openai-tokens-per-minute", type=int, default=30000)
+    arg_parser.add_argument("--translation-memory-threshold", type=float, default=0.8,
+                            help="reuse the translation of a definition of the same word whose text is at least this "
+                                 "similar (0-1); 0 disables the translation memory")
+    arg_parser.add_argument("--translation-cache-max-entries", type=int, default=TRANSLATION_CACHE_MAX_ENTRIES,
+                            help="translations kept in data/translations.sqlite before the least recently used are "
+                                 "evicted (default: %(default)s); 0 keeps all of them")
+    arg_parser.add_argument("--page-cache-max-bytes", type=int, default=PAGE_CACHE_MAX_BYTES,
+                            help="compressed size of data/page_cache before the least recently used pages are evicted "
+                                 "(default: %(default)s); 0 keeps all of them")
+    arg_parser.add_argument("--shard-by", choices=("word_form", "source"), default=None,
+                            help="write one sub-deck per word form or per export file instead of a single deck")
+    arg_parser.add_argument("--deck-batch-size", type=int, default=1000,
+                            help="notes written to the deck database per transaction")
+    arg_parser.add_argument("--deck-processes", type=int, default=None,
+                            help="processes writing sub-decks in parallel (default: one per CPU)")
+    arg_parser.add_argument("--metrics", default="data/metrics.json",
+                            help="where to write the run's metrics; Prometheus text format if it ends in .prom")
+    arg_parser.add_argument("--profile", nargs="?", const="data/profile.pstats", default=None,
+                            help="sample the stacks of all threads and write the stats to this file "
+                                 "(default: %(const)s)")
+    args = arg_parser.parse_args()
+
+    Word.base_url = args.oxford_url
+
+    def run():
+        translator = AsyncTranslator(max_concurrency=args.translate_concurrency,
+                                     requests_per_minute=args.openai_requests_per_minute,
+                                     tokens_per_minute=args.openai_tokens_per_minute) \
+            if args.translate_concurrency > 0 else None
+        generator = AnkiDeckGenerator(max_workers=args.scrape_workers, requests_per_second=args.requests_per_second,
+                                      max_requests_per_second=args.max_requests_per_second or None,
+                                      translation_memory_threshold=args.translation_memory_threshold,
+                                      translation_cache_max_entries=args.translation_cache_max_entries or None,
+                                      page_cache=PageCache(max_bytes=args.page_cache_max_bytes or None),
+                                      translator=translator)
+        try:
+            with metrics.timer("pipeline_run_seconds"):
+                Pipeline(generator, scrape_workers=args.scrape_workers, translate_workers=args.translate_workers,
+                         audio_workers=args.audio_workers, queue_size=args.queue_size).run(
+                    NotesParser.iter_all_in_dir(args.sources, "data/parse_manifest.json", args.parse_processes))
+            generator.generate_anki_deck(shard_by=args.shard_by, batch_size=args.deck_batch_size,
+                                         processes=args.deck_processes)
+        finally:
+            generator.record_stats()
+            metrics.dump(args.metrics)
+            logger.info(f"Metrics written to {args.metrics}")
+
+    if args.profile:
+        # samples every thread, so scraping, parsing, translation and store writes in the pipeline's threads show up
+        with profiled(args.profile) as report:
+            run()
+        logger.info(report.getvalue())
+    else:
+        run()
@@ -2,6 +2,9 @@ from genanki import Model
 from pydantic import BaseModel
 from typing import List, Dict, Optional
 
+# bump whenever the rendered note fields change so cached renderings are rebuilt
+TEMPLATE_VERSION = "2"
+
 default_de_en_model = Model(
     1281009654,
     'Default (de->en)',
@@ -104,66 +107,85 @@ class WordFormDefinitionStack(BaseModel):
 
 class WordData(BaseModel):
     ipa: str
+    # file name of the pronunciation recording in the media store, if one was downloaded
+    audio: Optional[str] = None
     definitions: List[WordFormDefinitionStack]
 
 
-def map_word_data_to_anki(word: str, word_data: WordData):
+def validate_word_data(data):
+    """
+    Check word data against the WordData schema before it is stored; raises pydantic.ValidationError.
+    The data itself is stored unchanged, so keys outside the schema are kept.
+    """
+    WordData.model_validate(data)
+    return data
+
+
+def map_word_data_to_anki(word: str, word_data):
     """
     Maps a word and its data to anki fields for both the english to german and german to english models
     :param word: the word
-    :param word_data: the data for the word
+    :param word_data: the data for the word, a WordData or the stored dict, which was validated when it was stored
     :return: (en_to_de_values, de_to_en_values)
     """
-    ipa = word_data.ipa
+    if isinstance(word_data, WordData):
+        word_data = word_data.model_dump()
+    audio = word_data.get("audio")
+    ipa = f"{word_data['ipa']} [sound:{audio}]" if audio else word_data["ipa"]
     definitions = _build_definition_string(word_data)
     en_to_de_values = (word, ipa, definitions)
-    # filter definitions by german translation
+    # group definitions by german translation
     defs_by_de = {}
-    for word_form_stack in word_data.definitions:
-        for def_stack in word_form_stack.definitions:
-            for definition in def_stack.definitions:
-                if definition.german_translation not in defs_by_de:
-                    defs_by_de[definition.german_translation] = []
-                defs_by_de[definition.german_translation].append((definition, def_stack.namespace))
+    for word_form_stack in word_data["definitions"]:
+        for def_stack in word_form_stack["definitions"]:
+            for definition in def_stack["definitions"]:
+                defs_by_de.setdefault(definition["german_translation"], []).append(definition)
     de = "<br>".join(defs_by_de.keys())
-    word_data_de = WordData(ipa=ipa, definitions=[WordFormDefinitionStack(id="", word_form="", definitions=[])])
-    for german_translation, definitions in defs_by_de.items():
-        word_data_de.definitions[0].definitions.append(
-            DefinitionStack(namespace=german_translation if len(definitions) > 1 else "__GLOBAL__",
-                            definitions=[Definition.model_validate(definition[0]) for
-                                         definition in definitions]))
-    de_to_en_values = (de, word, ipa, _build_definition_string(word_data_de, False))
+    groups_de = [("", german_translation if len(definitions) > 1 else "__GLOBAL__", definitions)
+                 for german_translation, definitions in defs_by_de.items()]
+    parts = []
+    _render_definitions(parts, groups_de, False)
+    de_to_en_values = (de, word, ipa, "".join(parts))
     return en_to_de_values, de_to_en_values
 
 
 def _build_definition_string(word_data, include_german_translation=True):
-    definitions = ""
-    for word_form_stack in word_data.definitions:
-        for def_stack in word_form_stack.definitions:
-            if def_stack.namespace == "__GLOBAL__":
-                namespace = ""
-            else:
-                namespace = f"<br><br>{def_stack.namespace}<br>"
-            definitions += namespace
-            for definition in def_stack.definitions:
-                definitions += "<hr class='namespace_div'>"
-                definitions += f"<i>{word_form_stack.word_form}</i><br>" if word_form_stack.word_form else ""
-                if include_german_translation:
-                    definitions += f"<br>Übersetzung: <b>{definition.german_translation}</b><br><br>"
-                definitions += (
-                                   f"[<i>{definition.property.replace("[", "").replace("]", "")}</i>] " if definition.property else "") + (
-                                   f"{definition.description}<br>")
-                if definition.examples:
-                    definitions += "<ul>"
-                    if len(definition.examples) > 2:
-                        definition.examples = definition.examples[:2]
-                    for example in definition.examples:
-                        definitions += f"<li>{example}</li>"
-                    definitions += "</ul><br>"
-                if definition.synonyms or definition.references:
-                    definitions += "Synonyms/References: "
-                    references_list = [ref.name for ref in definition.references] if definition.references else []
-                    synonyms_list = [word for words in definition.synonyms.values() for word in
-                                     words] if definition.synonyms else []
-                    definitions += "▪".join(references_list + list(synonyms_list))
-    return definitions
+    groups = [(word_form_stack["word_form"], def_stack["namespace"], def_stack["definitions"])
+              for word_form_stack in word_data["definitions"] for def_stack in word_form_stack["definitions"]]
+    parts = []
+    _render_definitions(parts, groups, include_german_translation)
+    return "".join(parts)
+
+
+def _render_definitions(parts, groups, include_german_translation):
+    """
+    Appends the html for (word_form, namespace, definitions) groups to parts; callers join once at the end.
+    Does not modify the definitions.
+    """
+    append = parts.append
+    for word_form, namespace, definitions in groups:
+        if namespace != "__GLOBAL__":
+            append(f"<br><br>{namespace}<br>")
+        word_form_line = f"<i>{word_form}</i><br>" if word_form else ""
+        for definition in definitions:
+            append("<hr class='namespace_div'>")
+            append(word_form_line)
+            if include_german_translation:
+                append(f"<br>Übersetzung: <b>{definition['german_translation']}</b><br><br>")
+            if definition.get("property"):
+                append(f"[<i>{definition['property'].replace("[", "").replace("]", "")}</i>] ")
+            append(f"{definition['description']}<br>")
+            examples = definition.get("examples")
+            if examples:
+                append("<ul>")
+                for example in examples[:2]:
+                    append(f"<li>{example}</li>")
+                append("</ul><br>")
+            references = definition.get("references")
+            synonyms = definition.get("synonyms")
+            if synonyms or references:
+                append("Synonyms/References: ")
+                names = [ref["name"] for ref in references] if references else []
+                if synonyms:
+                    names += [word for words in synonyms.values() for word in words]
+                append("▪".join(names))
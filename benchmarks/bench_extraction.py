@@ -0,0 +1,52 @@
+""" micro-benchmark for the per-page CPU cost of oxford.Word parsing and extraction """
+import argparse
+import os
+import sys
+import time
+from glob import glob
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oxford import Word  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "oxford")
+
+
+def access_like_scrape_dictionary(word):
+    # the properties AnkiDeckGenerator.scrape_dictionary touches, plus a full info dump
+    word.pronunciations
+    word.pronunciations
+    word.definition_full
+    word.name
+    word.id
+    word.wordform
+    word.info
+
+
+def bench_page(html, iterations):
+    start = time.perf_counter()
+    words = [Word.from_html(html) for _ in range(iterations)]
+    parsed = time.perf_counter()
+    for word in words:
+        access_like_scrape_dictionary(word)
+    extracted = time.perf_counter()
+    return (parsed - start) / iterations, (extracted - parsed) / iterations
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("pages", nargs="*", help="html pages to benchmark (default: bundled fixtures)")
+    arg_parser.add_argument("-n", "--iterations", type=int, default=50)
+    args = arg_parser.parse_args()
+
+    pages = args.pages or sorted(glob(os.path.join(FIXTURES, "*.html")))
+    for path in pages:
+        with open(path, "rb") as file:
+            html = file.read()
+        parse_time, extract_time = bench_page(html, args.iterations)
+        print(f"{os.path.basename(path):<30} parse {parse_time * 1000:8.3f} ms/page   "
+              f"extract {extract_time * 1000:8.3f} ms/page")
+
+
+if __name__ == "__main__":
+    main()
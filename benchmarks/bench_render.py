@@ -0,0 +1,45 @@
+""" golden check and micro-benchmark for rendering anki note fields with anki_models.map_word_data_to_anki """
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anki_models import WordData, map_word_data_to_anki  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("-n", "--iterations", type=int, default=2000)
+    args = arg_parser.parse_args()
+
+    with open(os.path.join(FIXTURES, "word_data.json"), "r", encoding="utf8") as file:
+        raw_words = json.load(file)
+    words = {word: WordData.model_validate(data) for word, data in raw_words.items()}
+    with open(os.path.join(FIXTURES, "word_data_rendered.json"), "r", encoding="utf8") as file:
+        golden = json.load(file)
+
+    for kind, word_data_by_word in (("WordData", words), ("stored dicts", raw_words)):
+        rendered = {word: [list(fields) for fields in map_word_data_to_anki(word, word_data)]
+                    for word, word_data in word_data_by_word.items()}
+        if rendered != golden:
+            mismatched = [word for word in golden if rendered.get(word) != golden[word]]
+            print(f"FAIL fields rendered from {kind} differ from golden output for: {mismatched}")
+            sys.exit(1)
+        print(f"ok   fields rendered from {kind} match golden output for {len(golden)} words")
+
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        for word, word_data in raw_words.items():
+            map_word_data_to_anki(word, word_data)
+    elapsed = time.perf_counter() - start
+    print(f"map_word_data_to_anki {elapsed / (args.iterations * len(words)) * 1e6:8.1f} µs/word "
+          f"(both note directions)")
+
+
+if __name__ == "__main__":
+    main()
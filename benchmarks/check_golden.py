@@ -0,0 +1,66 @@
+""" check that every html parser backend extracts exactly the recorded golden output from the fixtures """
+import argparse
+import importlib.util
+import json
+import os
+import sys
+from glob import glob
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from oxford import Word  # noqa: E402
+from parser import NotesParser  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def available_backends():
+    backends = ["html.parser"]
+    if importlib.util.find_spec("lxml") is not None:
+        backends.append("lxml")
+    return backends
+
+
+def extract_oxford(path, backend):
+    Word.html_parser = backend
+    with open(path, "rb") as file:
+        return Word.from_html(file.read()).info
+
+
+def extract_export(path, backend):
+    NotesParser.HTML_PARSER = backend
+    return NotesParser.parse_any(path)
+
+
+# (fixture pattern, extraction, backends in addition to the available BeautifulSoup tree builders)
+CASES = [
+    (os.path.join(FIXTURES, "oxford", "*.html"), extract_oxford, []),
+    (os.path.join(FIXTURES, "exports", "kindle_*.html"), extract_export, ["stream"]),
+    (os.path.join(FIXTURES, "exports", "apple_books_*.txt"), extract_export, ["stream"]),
+]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--update", action="store_true", help="rewrite the golden files with html.parser output")
+    args = arg_parser.parse_args()
+
+    failures = 0
+    for pattern, extract, extra_backends in CASES:
+        for path in sorted(glob(pattern)):
+            golden_path = os.path.splitext(path)[0] + ".json"
+            if args.update:
+                with open(golden_path, "w", encoding="utf8") as file:
+                    json.dump(extract(path, "html.parser"), file, ensure_ascii=False, indent=1)
+                continue
+            with open(golden_path, "r", encoding="utf8") as file:
+                golden = json.load(file)
+            for backend in extra_backends + available_backends():
+                ok = extract(path, backend) == golden
+                failures += not ok
+                print(f"{'ok  ' if ok else 'FAIL'} {backend:<12} {os.path.relpath(path, FIXTURES)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+end-to-end load test: runs anki_generator.py on a synthetic export against local Oxford and OpenAI stand-ins
+and reports words/minute, tail latencies and retries
+
+    python benchmarks/load_test.py --words 10000 --rate-limit-rate 0.02 --error-rate 0.01 -- \
+        --requests-per-second 50 --scrape-workers 16 --translate-concurrency 8
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from stub_servers import OxfordStub, OpenAIStub, StubServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LETTERS = "abcdefghijklmnopqrstuvwxyz"
+
+
+def pseudo_word(index):
+    """ distinct letters-only words ('ba', 'bb', ...) that survive NotesParser's cleaning """
+    word = ""
+    while True:
+        index, remainder = divmod(index, len(LETTERS))
+        word = LETTERS[remainder] + word
+        if index == 0:
+            return "b" + word
+
+
+def write_export(path, words):
+    with open(path, "w", encoding="utf8") as file:
+        file.write("Excerpts From\nLoad Test\nJane Doe\nThis material may be protected by copyright.\n\n"
+                   "NOTES FROM\nLoad Test\nJane Doe\n\n")
+        for i in range(words):
+            file.write(f"{i + 1}. October 2023  \n{pseudo_word(i)}\n\n")
+
+
+def latency_row(histograms, name):
+    histogram = histograms.get(name)
+    if not histogram or not histogram["count"]:
+        return f"  {name:<30} -"
+    return (f"  {name:<30} n={histogram['count']:<7} mean {histogram['mean'] * 1000:8.1f} ms   "
+            f"p50 ≤{histogram['p50'] * 1000:8.1f} ms   p95 ≤{histogram['p95'] * 1000:8.1f} ms   "
+            f"p99 ≤{histogram['p99'] * 1000:8.1f} ms   max {histogram['max'] * 1000:8.1f} ms")
+
+
+def report(run_metrics, oxford, openai, wall_time):
+    counters = run_metrics["counters"]
+    histograms = run_metrics["histograms"]
+    gauges = run_metrics["gauges"]
+    persisted = counters.get("pipeline_persisted_total", 0)
+    pipeline_time = histograms.get("pipeline_run_seconds", {}).get("sum") or wall_time
+    # page lookups plus recording downloads, both go to the dictionary host
+    oxford_logical = counters.get("oxford_requests_total", 0) + counters.get("media_misses_total", 0)
+
+    print(f"words persisted     {persisted} in {pipeline_time:.1f} s  ->  {persisted / pipeline_time * 60:,.0f} "
+          f"words/minute  (wall time incl. startup and deck {wall_time:.1f} s)")
+    print(f"words failed        {counters.get('pipeline_failed_total', 0)}")
+    print("latency (bucket upper bounds)")
+    for name in ("oxford_rate_wait_seconds", "oxford_fetch_seconds", "media_fetch_seconds",
+                 "translate_request_seconds", "pipeline_scrape_seconds", "pipeline_fetch_audio_seconds",
+                 "pipeline_translate_seconds", "pipeline_persist_seconds", "store_write_seconds",
+                 "deck_build_seconds"):
+        print(latency_row(histograms, name))
+    if "oxford_rate_per_second" in gauges:
+        print(f"oxford rate         {gauges['oxford_rate_per_second']:.1f} requests/s at the end, "
+              f"{counters.get('oxford_throttled_total', 0)} throttled or failed, "
+              f"{counters.get('oxford_rate_decreases_total', 0)} cuts, "
+              f"circuit opened {counters.get('oxford_circuit_opens_total', 0)} times")
+    print("retries")
+    print(f"  oxford     {oxford['requests'] - oxford_logical} transport retries for {oxford_logical} requests, "
+          f"responses {oxford['responses']}")
+    print(f"  openai     {counters.get('translate_retries_total', 0)} retries, "
+          f"{counters.get('translate_rate_limited_total', 0)} rate limited (async translator); "
+          f"{openai['requests'] - counters.get('translate_requests_total', 0)} retried by the client overall, "
+          f"responses {openai['responses']}")
+    print(f"tokens              {counters.get('translate_prompt_tokens_total', 0)} prompt + "
+          f"{counters.get('translate_completion_tokens_total', 0)} completion")
+    if "translation_cache_hit_rate" in gauges:
+        print(f"translation cache   hit rate {gauges['translation_cache_hit_rate']:.1%}")
+    if "translation_memory_avoided_translations" in gauges:
+        print(f"translation memory  {gauges['translation_memory_avoided_translations']:.0f} definitions reused "
+              f"instead of translated")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--words", type=int, default=10000, help="distinct words in the synthetic export")
+    arg_parser.add_argument("--oxford-latency", type=float, default=0.15, help="median seconds per page")
+    arg_parser.add_argument("--openai-latency", type=float, default=0.8, help="median seconds per completion")
+    arg_parser.add_argument("--jitter", type=float, default=0.5, help="sigma of the log-normal latency")
+    arg_parser.add_argument("--error-rate", type=float, default=0.01, help="share of 503 responses")
+    arg_parser.add_argument("--rate-limit-rate", type=float, default=0.01, help="share of random 429 responses")
+    arg_parser.add_argument("--openai-rpm", type=int, default=None,
+                            help="requests per minute the OpenAI stand-in accepts before answering 429")
+    arg_parser.add_argument("--oxford-rps", type=float, default=None,
+                            help="requests per second the Oxford stand-in accepts before answering 429")
+    arg_parser.add_argument("--not-found-rate", type=float, default=0.02)
+    arg_parser.add_argument("--homograph-rate", type=float, default=0.2)
+    arg_parser.add_argument("--keep", action="store_true", help="keep the working directory with logs and data")
+    arg_parser.add_argument("generator_args", nargs=argparse.REMAINDER,
+                            help="arguments after -- are passed to anki_generator.py")
+    args = arg_parser.parse_args()
+    generator_args = [arg for arg in args.generator_args if arg != "--"]
+
+    shared = dict(jitter=args.jitter, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    oxford = StubServer(OxfordStub(latency=args.oxford_latency, not_found_rate=args.not_found_rate,
+                                   homograph_rate=args.homograph_rate, requests_per_second=args.oxford_rps,
+                                   **shared)).start()
+    openai = StubServer(OpenAIStub(latency=args.openai_latency, requests_per_minute=args.openai_rpm,
+                                   seed=1, **shared)).start()
+    directory = tempfile.mkdtemp(prefix="anki-load-test-")
+    returncode = 1
+    try:
+        os.makedirs(os.path.join(directory, "sources"))
+        write_export(os.path.join(directory, "sources", "load_test.txt"), args.words)
+        command = [sys.executable, os.path.join(ROOT, "anki_generator.py"), "--sources", "sources",
+                   "--oxford-url", oxford.url, "--metrics", "metrics.json"] + generator_args
+        environment = dict(os.environ, OPENAI_BASE_URL=f"{openai.url}/v1", OPENAI_API_KEY="load-test")
+        print(f"running {' '.join(command[1:])}")
+        start = time.perf_counter()
+        with open(os.path.join(directory, "generator.log"), "w", encoding="utf8") as log:
+            returncode = subprocess.call(command, cwd=directory, env=environment, stdout=log, stderr=subprocess.STDOUT)
+        wall_time = time.perf_counter() - start
+        if returncode != 0:
+            print(f"anki_generator.py exited with {returncode}, see {os.path.join(directory, 'generator.log')}")
+            args.keep = True
+        metrics_path = os.path.join(directory, "metrics.json")
+        if os.path.exists(metrics_path):
+            with open(metrics_path, "r", encoding="utf8") as file:
+                report(json.load(file), oxford.service.stats, openai.service.stats, wall_time)
+    finally:
+        oxford.stop()
+        openai.stop()
+        if args.keep:
+            print(f"working directory kept at {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+    sys.exit(returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+""" offline benchmark suite: throughput of every pipeline stage on the bundled fixtures, checked against thresholds """
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from glob import glob
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# the OpenAI client is created at import time; no request is sent, translations come from StubTranslator
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from anki_generator import AnkiDeckGenerator  # noqa: E402
+from anki_models import map_word_data_to_anki  # noqa: E402
+from bench_extraction import access_like_scrape_dictionary  # noqa: E402
+from data_store import VocabStore  # noqa: E402
+from oxford import Word  # noqa: E402
+from page_cache import PageCache  # noqa: E402
+from parser import NotesParser  # noqa: E402
+from pipeline import Pipeline  # noqa: E402
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(BENCHMARKS, "fixtures")
+THRESHOLDS = os.path.join(BENCHMARKS, "thresholds.json")
+
+# words looked up by the scrape -> translate -> persist benchmark and the fixture pages their search lands on
+SEARCHES = {"game": "game_1", "curmudgeon": "curmudgeon", "beaver": "beaver_1"}
+
+HIGHLIGHT_WORDS = ["curmudgeon", "obstreperous", "Ran", "game", "beaver", "serendipity", "ubiquitous",
+                   "ephemeral", "laconic", "quixotic", "sycophant", "garrulous", "taciturn", "pernicious"]
+HIGHLIGHT_SENTENCES = ["He was, by any reasonable measure, the most disagreeable man in the village.",
+                       "The rain had not stopped for three days and the river was rising."]
+
+
+class StubTranslator:
+    """ stands in for gpt_translate.AsyncTranslator; answers instantly, or after `latency` seconds per batch """
+
+    def __init__(self, latency=0.0, batch_size=20):
+        self.latency = latency
+        self.batch_size = batch_size
+        self.requests = 0
+
+    def translate_definitions_sync(self, items, cache=None):
+        translations = [cache.get(*item) if cache is not None else None for item in items]
+        missing = [i for i, translation in enumerate(translations) if translation is None]
+        for start in range(0, len(missing), self.batch_size):
+            self.requests += 1
+            if self.latency:
+                time.sleep(self.latency)
+            for i in missing[start:start + self.batch_size]:
+                translations[i] = f"de:{items[i][0]}:{i}"
+                if cache is not None:
+                    cache.put(*items[i], translations[i])
+        return translations
+
+    @property
+    def stats(self):
+        return {"requests": self.requests}
+
+
+def write_kindle_export(path, highlights, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf8") as file:
+        file.write("<?xml version=\"1.0\" encoding=\"UTF-8\" ?>\n<html><head><meta charset=\"UTF-8\" /></head>"
+                   "<body>\n<div class='bodyContainer'>\n<div class='notebookFor'>\nNotebook Export\n</div>\n"
+                   "<div class='bookTitle'>Synthetic Book\n</div>\n<hr/>\n")
+        for i in range(highlights):
+            text = rng.choice(HIGHLIGHT_SENTENCES) if i % 3 == 2 else rng.choice(HIGHLIGHT_WORDS)
+            file.write(f"<div class='noteHeading'>Highlight (<span class='highlight_yellow'>yellow</span>) - "
+                       f"Location {i}</div>\n<div class='noteText'>{text}</div>")
+        file.write("\n</div>\n</body>\n</html>\n")
+
+
+def write_apple_books_export(path, highlights, seed=0):
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf8") as file:
+        file.write("Excerpts From\nSynthetic Book\nJane Doe\nThis material may be protected by copyright.\n\n"
+                   "NOTES FROM\nSynthetic Book\nJane Doe\n\n")
+        for i in range(highlights):
+            text = rng.choice(HIGHLIGHT_SENTENCES) if i % 3 == 2 else rng.choice(HIGHLIGHT_WORDS)
+            file.write(f"{i + 1}. October 2023  \n{text}\n\n")
+
+
+def seed_page_cache(cache):
+    """ serve every oxford fixture under its definition url, and the SEARCHES under their search url """
+    pages = {}
+    for path in glob(os.path.join(FIXTURES, "oxford", "*.html")):
+        with open(path, "rb") as file:
+            pages[os.path.splitext(os.path.basename(path))[0]] = file.read()
+    for entry_id, content in pages.items():
+        cache.put(_url(entry_id, by_id=True), content)
+    for word, entry_id in SEARCHES.items():
+        cache.put(_url(word, by_id=False), pages[entry_id])
+
+
+def _url(word, by_id):
+    # the url Word(word, by_id) would request, without fetching it
+    holder = Word.__new__(Word)
+    holder.word = word
+    return holder.get_url(by_id)
+
+
+@contextmanager
+def in_temp_dir():
+    """ AnkiDeckGenerator keeps its caches and the deck relative to the working directory """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            yield directory
+        finally:
+            os.chdir(cwd)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_parsers(sizes):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            for name, write in (("kindle", write_kindle_export), ("apple_books", write_apple_books_export)):
+                path = os.path.join(directory, f"{name}_{size}{'.html' if name == 'kindle' else '.txt'}")
+                write(path, size)
+                _, elapsed = timed(NotesParser.parse_any, path)
+                results.append((f"parse_{name}_{size}", "highlights/s", size, elapsed))
+    return results
+
+
+def bench_extraction(iterations):
+    results = []
+    for path in sorted(glob(os.path.join(FIXTURES, "oxford", "*.html"))):
+        with open(path, "rb") as file:
+            html = file.read()
+
+        def extract():
+            for _ in range(iterations):
+                access_like_scrape_dictionary(Word.from_html(html))
+
+        _, elapsed = timed(extract)
+        results.append((f"extract_{os.path.splitext(os.path.basename(path))[0]}", "pages/s", iterations, elapsed))
+    return results
+
+
+def bench_scrape_translate_persist(rounds):
+    """ Pipeline over the SEARCHES (and their homographs) from an offline page cache with the stub translator """
+    words = 0
+    elapsed = 0.0
+    with tempfile.TemporaryDirectory() as cache_directory:
+        page_cache = PageCache(cache_directory, offline=True)
+        seed_page_cache(page_cache)
+        for _ in range(rounds):
+            # every round starts with an empty store and translation cache
+            with in_temp_dir():
+                store = VocabStore(legacy_json_path=None)
+                generator = AnkiDeckGenerator(max_workers=4, requests_per_second=1000, page_cache=page_cache,
+                                              data_store=store, translator=StubTranslator())
+                persisted, round_elapsed = timed(Pipeline(generator).run, list(SEARCHES))
+                words += persisted
+                elapsed += round_elapsed
+                store.close()
+                generator.translation_cache.close()
+                generator.translation_memory.close()
+        page_cache.close()
+    return [("scrape_translate_persist", "words/s", words, elapsed)]
+
+
+def load_word_data():
+    with open(os.path.join(FIXTURES, "word_data.json"), "r", encoding="utf8") as file:
+        return json.load(file)
+
+
+def bench_render(iterations):
+    # the deck build renders the stored dicts
+    words = load_word_data()
+
+    def render():
+        for _ in range(iterations):
+            for word, word_data in words.items():
+                map_word_data_to_anki(word, word_data)
+
+    _, elapsed = timed(render)
+    return [("map_word_data_to_anki", "words/s", iterations * len(words), elapsed)]
+
+
+def bench_deck(size):
+    """ generate_anki_deck for `size` synthetic words: cold (everything rendered) and warm (rendered cache reused) """
+    word_data = list(load_word_data().items())
+    with in_temp_dir():
+        store = VocabStore(legacy_json_path=None)
+        for i in range(size):
+            word, data = word_data[i % len(word_data)]
+            store[f"{word}{i}"] = data
+        generator = AnkiDeckGenerator(page_cache=PageCache(offline=True), data_store=store,
+                                      translator=StubTranslator())
+        _, cold = timed(generator.generate_anki_deck)
+        _, warm = timed(generator.generate_anki_deck)
+        store.close()
+        generator.translation_cache.close()
+        generator.translation_memory.close()
+    return [(f"generate_anki_deck_cold_{size}", "words/s", size, cold),
+            (f"generate_anki_deck_warm_{size}", "words/s", size, warm)]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000],
+                            help="highlights per synthetic export")
+    arg_parser.add_argument("--iterations", type=int, default=20, help="extractions per oxford fixture")
+    arg_parser.add_argument("--rounds", type=int, default=20, help="pipeline runs over the sample searches")
+    arg_parser.add_argument("--render-iterations", type=int, default=2000)
+    arg_parser.add_argument("--deck-size", type=int, default=5000, help="words in the generated deck")
+    arg_parser.add_argument("--json", help="also write the results to this file")
+    arg_parser.add_argument("--update-thresholds", action="store_true",
+                            help="record the measured throughput times --margin as the new thresholds")
+    arg_parser.add_argument("--margin", type=float, default=0.5,
+                            help="fraction of the measured throughput a later run must reach")
+    args = arg_parser.parse_args()
+
+    logging.disable(logging.INFO)
+    results = (bench_parsers(args.sizes) + bench_extraction(args.iterations) +
+               bench_scrape_translate_persist(args.rounds) + bench_render(args.render_iterations) +
+               bench_deck(args.deck_size))
+
+    thresholds = {}
+    if os.path.exists(THRESHOLDS):
+        with open(THRESHOLDS, "r", encoding="utf8") as file:
+            thresholds = json.load(file)
+
+    report = {}
+    failures = 0
+    for name, unit, amount, elapsed in results:
+        throughput = amount / elapsed
+        threshold = thresholds.get(name)
+        ok = threshold is None or args.update_thresholds or throughput >= threshold
+        failures += not ok
+        status = "ok  " if ok else "SLOW"
+        limit = f"(min {threshold:,.0f})" if threshold is not None else "(no threshold)"
+        print(f"{status} {name:<34} {throughput:>12,.1f} {unit:<13} {limit}")
+        report[name] = {"unit": unit, "amount": amount, "seconds": elapsed, "throughput": throughput,
+                        "threshold": threshold}
+
+    if args.json:
+        with open(args.json, "w", encoding="utf8") as file:
+            json.dump(report, file, indent=2)
+    if args.update_thresholds:
+        thresholds.update({name: round(result["throughput"] * args.margin, 1) for name, result in report.items()})
+        with open(THRESHOLDS, "w", encoding="utf8") as file:
+            json.dump(thresholds, file, indent=1, sort_keys=True)
+        print(f"thresholds written to {os.path.relpath(THRESHOLDS)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+""" local stand-ins for the Oxford dictionary website and the OpenAI chat completions endpoint, for load tests """
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "oxford")
+OXFORD_URL = "https://www.oxfordlearnersdictionaries.com"
+
+
+class StubService:
+    """
+    Answers requests after a log-normally distributed delay (median `latency` seconds, spread `jitter`),
+    and fails a random share of them with 429 (`rate_limit_rate`) or 503 (`error_rate`).
+    """
+
+    def __init__(self, latency=0.05, jitter=0.5, error_rate=0.0, rate_limit_rate=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        # set by StubServer; absolute links in served pages point here
+        self.base_url = None
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.responses = {}
+
+    def _count(self, status):
+        with self._lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+
+    def respond(self, method, path, body):
+        """ :return: status, headers dict, body bytes """
+        with self._lock:
+            delay = self.latency * self._random.lognormvariate(0, self.jitter) if self.latency else 0
+            roll = self._random.random()
+        time.sleep(delay)
+        if roll < self.rate_limit_rate:
+            response = self.rate_limited()
+        elif roll < self.rate_limit_rate + self.error_rate:
+            response = 503, {"Content-Type": "text/plain"}, b"Service Unavailable"
+        else:
+            response = self.handle(method, path, body)
+        self._count(response[0])
+        return response
+
+    def rate_limited(self):
+        return 429, {"Content-Type": "text/plain", "Retry-After": "1"}, b"Too Many Requests"
+
+    def handle(self, method, path, body):
+        raise NotImplementedError
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {"requests": sum(self.responses.values()),
+                    "responses": {str(status): count for status, count in sorted(self.responses.items())}}
+
+
+class OxfordStub(StubService):
+    """
+    Serves search (/search/english/direct/?q=...) and definition (/definition/english/<id>) pages built from the
+    recorded fixtures, and a small fake recording for every /media/ path. A stable, hash-based share of words is
+    unknown (404) or a two-entry homograph family. With `requests_per_second` set, requests beyond that rate
+    (over a sliding one second window) are answered with 429, like a site that throttles scrapers.
+    """
+
+    def __init__(self, not_found_rate=0.02, homograph_rate=0.2, requests_per_second=None, **kwargs):
+        super().__init__(**kwargs)
+        self.not_found_rate = not_found_rate
+        self.homograph_rate = homograph_rate
+        self.requests_per_second = requests_per_second
+        self._window = []
+        self.templates = {}
+        for name in ("curmudgeon", "beaver_1", "beaver_2"):
+            with open(os.path.join(FIXTURES, f"{name}.html"), "r", encoding="utf8") as file:
+                self.templates[name] = file.read()
+
+    @staticmethod
+    def _share(word):
+        # the same word always gets the same kind of page, however often it is requested
+        return int(hashlib.sha256(word.encode("utf8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+
+    def _page(self, word, number):
+        share = self._share(word)
+        if share < self.not_found_rate:
+            return None
+        if share < self.not_found_rate + self.homograph_rate:
+            template, stem = {None: "beaver_1", 1: "beaver_1", 2: "beaver_2"}.get(number), "beaver"
+        else:
+            template, stem = ("curmudgeon" if number is None else None), "curmudgeon"
+        if template is None:
+            return None
+        page = self.templates[template].replace(stem, word)
+        if self.base_url is not None:
+            page = page.replace(OXFORD_URL, self.base_url)
+        return page.encode("utf8")
+
+    def _over_capacity(self):
+        if self.requests_per_second is None:
+            return False
+        with self._lock:
+            now = time.monotonic()
+            self._window = [stamp for stamp in self._window if now - stamp < 1]
+            if len(self._window) >= self.requests_per_second:
+                return True
+            self._window.append(now)
+            return False
+
+    def handle(self, method, path, body):
+        if self._over_capacity():
+            return self.rate_limited()
+        url = urlsplit(path)
+        if url.path.startswith("/media/"):
+            return 200, {"Content-Type": "audio/ogg"}, b"OggS" + hashlib.sha256(url.path.encode("utf8")).digest() * 64
+        if url.path.startswith("/search/english/direct"):
+            word, number = unquote(parse_qs(url.query).get("q", [""])[0]), None
+        elif url.path.startswith("/definition/english/"):
+            word, _, number = unquote(url.path.rsplit("/", 1)[-1]).partition("_")
+            number = int(number) if number.isdigit() else None
+        else:
+            return 404, {"Content-Type": "text/plain"}, b"Not Found"
+        page = self._page(word, number)
+        if page is None:
+            return 404, {"Content-Type": "text/html"}, b"<html><body>Word not found</body></html>"
+        return 200, {"Content-Type": "text/html; charset=utf-8"}, page
+
+
+class OpenAIStub(StubService):
+    """
+    Minimal /v1/chat/completions: batch requests (json_object response format) get one translation per item,
+    single requests a short string. With `requests_per_minute` set, requests beyond that rate (over a sliding one
+    minute window) are answered with 429, and every response carries the x-ratelimit-limit/remaining/reset-requests
+    headers like the real API. Reset and retry-after-ms are the time until the oldest request leaves the window,
+    i.e. until the next request is accepted.
+    """
+
+    def __init__(self, requests_per_minute=None, **kwargs):
+        super().__init__(**kwargs)
+        self.requests_per_minute = requests_per_minute
+        self._window = []
+        self.tokens = 0
+
+    def _admit(self):
+        """ (accepted, remaining requests, seconds until the oldest request leaves the window); None if unlimited """
+        if self.requests_per_minute is None:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            self._window = [stamp for stamp in self._window if now - stamp < 60]
+            accepted = len(self._window) < self.requests_per_minute
+            if accepted:
+                self._window.append(now)
+            reset = 60 - (now - self._window[0]) if len(self._window) >= self.requests_per_minute else 0.0
+            return accepted, self.requests_per_minute - len(self._window), reset
+
+    @staticmethod
+    def _duration(seconds):
+        """ the api's duration format, e.g. '120ms', '1.5s', '1m0.25s' """
+        if seconds < 1:
+            return f"{round(seconds * 1000)}ms"
+        minutes, seconds = divmod(seconds, 60)
+        return f"{int(minutes)}m{seconds:.3g}s" if minutes else f"{seconds:.3g}s"
+
+    def _limit_headers(self, remaining, reset):
+        return {"x-ratelimit-limit-requests": str(self.requests_per_minute),
+                "x-ratelimit-remaining-requests": str(remaining),
+                "x-ratelimit-reset-requests": self._duration(reset)}
+
+    def rate_limited(self, admission=None):
+        body = {"error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}}
+        headers = {"Content-Type": "application/json"}
+        if admission is None:
+            # a random 429 (rate_limit_rate), not caused by the window
+            headers["retry-after-ms"] = "500"
+        else:
+            _, remaining, reset = admission
+            headers["retry-after-ms"] = str(max(1, round(reset * 1000)))
+            headers.update(self._limit_headers(remaining, reset))
+        return 429, headers, json.dumps(body).encode("utf8")
+
+    def handle(self, method, path, body):
+        if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+            return 404, {"Content-Type": "application/json"}, b'{"error": {"message": "not found"}}'
+        admission = self._admit()
+        if admission is not None and not admission[0]:
+            return self.rate_limited(admission)
+        request = json.loads(body)
+        prompt = request["messages"][-1]["content"]
+        if request.get("response_format", {}).get("type") == "json_object":
+            items = json.loads(prompt)
+            content = json.dumps({"translations": [f"Übersetzung von {item['word']}" for item in items]},
+                                 ensure_ascii=False)
+        else:
+            content = "Übersetzung"
+        prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+        completion_tokens = len(content) // 4 + 1
+        with self._lock:
+            self.tokens += prompt_tokens + completion_tokens
+        completion = {
+            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+        headers = {"Content-Type": "application/json"}
+        if admission is not None:
+            headers.update(self._limit_headers(*admission[1:]))
+        return 200, headers, json.dumps(completion, ensure_ascii=False).encode("utf8")
+
+    @property
+    def stats(self):
+        stats = super().stats
+        stats["tokens"] = self.tokens
+        return stats
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _serve(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        status, headers, payload = self.server.service.respond(self.command, self.path, body)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = _serve
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    """ serves a StubService on localhost from a background thread """
+    daemon_threads = True
+
+    def __init__(self, service, port=0):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.service = service
+        service.base_url = self.url
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name=type(self.service).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--oxford-port", type=int, default=8001)
+    arg_parser.add_argument("--openai-port", type=int, default=8002)
+    arg_parser.add_argument("--latency", type=float, default=0.05, help="median response time in seconds")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="share of 503 responses")
+    arg_parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of random 429 responses")
+    arg_parser.add_argument("--oxford-rps", type=float, default=None,
+                            help="requests per second the Oxford stand-in accepts before answering 429")
+    args = arg_parser.parse_args()
+
+    options = dict(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    oxford = StubServer(OxfordStub(requests_per_second=args.oxford_rps, **options), args.oxford_port).start()
+    openai = StubServer(OpenAIStub(**options), args.openai_port).start()
+    print(f"python anki_generator.py --oxford-url {oxford.url}  (with OPENAI_BASE_URL={openai.url}/v1)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        print(json.dumps({"oxford": oxford.service.stats, "openai": openai.service.stats}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
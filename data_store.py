@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+
+import pydantic
+
+from anki_models import validate_word_data
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.DEBUG)
+
+
+class VocabStore(MutableMapping):
+    """
+    SQLite-backed mapping of word -> word data that replaces the rewrite-everything data/data.json.
+    Every assignment is its own atomic upsert, lookups load a single word and iteration streams rows in batches,
+    so the vocabulary never has to be held in memory as a whole. An existing data.json is imported once; entries that
+    do not match the WordData schema are left out, so they are scraped again like new words.
+    """
+    batch_size = 500
+
+    def __init__(self, path="data/data.sqlite", legacy_json_path="data/data.json"):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS words (word TEXT PRIMARY KEY, data TEXT NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS aliases "
+                             "(surface TEXT PRIMARY KEY, headword TEXT NOT NULL, entry_id TEXT)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS rendered "
+                             "(word TEXT PRIMARY KEY, digest TEXT NOT NULL, fields TEXT NOT NULL)")
+        if legacy_json_path is not None:
+            self._migrate_json(legacy_json_path)
+
+    def _migrate_json(self, json_path):
+        with self._lock:
+            if self._get_meta("migrated_from") is not None or not os.path.exists(json_path):
+                return
+            with open(json_path, "r", encoding="utf8") as file:
+                legacy = json.load(file)
+            valid = {}
+            for word, data in legacy.items():
+                try:
+                    valid[word] = validate_word_data(data)
+                except pydantic.ValidationError as e:
+                    logger.warning(f"Not importing {word} from {json_path}: {e.error_count()} schema errors")
+            with self._db:
+                self._db.executemany("INSERT OR REPLACE INTO words (word, data) VALUES (?, ?)",
+                                     ((word, json.dumps(data, ensure_ascii=False)) for word, data in valid.items()))
+                self._set_meta("migrated_from", os.path.abspath(json_path))
+
+    def _get_meta(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _set_meta(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def __getitem__(self, word):
+        with self._lock:
+            row = self._db.execute("SELECT data FROM words WHERE word = ?", (word,)).fetchone()
+        if row is None:
+            raise KeyError(word)
+        return json.loads(row[0])
+
+    def __setitem__(self, word, data):
+        serialized = json.dumps(data, ensure_ascii=False)
+        with metrics.timer("store_write_seconds"), self._lock, self._db:
+            self._db.execute("INSERT INTO words (word, data) VALUES (?, ?) "
+                             "ON CONFLICT(word) DO UPDATE SET data = excluded.data", (word, serialized))
+
+    def __delitem__(self, word):
+        with self._lock, self._db:
+            if self._db.execute("DELETE FROM words WHERE word = ?", (word,)).rowcount == 0:
+                raise KeyError(word)
+            self._db.execute("DELETE FROM rendered WHERE word = ?", (word,))
+
+    def __contains__(self, word):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM words WHERE word = ?", (word,)).fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM words").fetchone()[0]
+
+    def _iter_rows(self):
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT rowid, word, data FROM words WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                        (last_rowid, self.batch_size)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_rowid = rows[-1][0]
+
+    def __iter__(self):
+        for _, word, _ in self._iter_rows():
+            yield word
+
+    def items(self):
+        for _, word, data in self._iter_rows():
+            yield word, json.loads(data)
+
+    def iter_with_rendered(self):
+        """
+        stream (word, raw data json, rendered digest, rendered fields json) for every word;
+        the last two are None if the word was never rendered
+        """
+        last_rowid = 0
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT words.rowid, words.word, words.data, rendered.digest, rendered.fields "
+                                        "FROM words LEFT JOIN rendered ON rendered.word = words.word "
+                                        "WHERE words.rowid > ? ORDER BY words.rowid LIMIT ?",
+                                        (last_rowid, self.batch_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield row[1:]
+            last_rowid = rows[-1][0]
+
+    def put_rendered(self, rows):
+        """ store (word, digest, fields json) rows of freshly rendered notes in one transaction """
+        with metrics.timer("store_write_seconds"), self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO rendered (word, digest, fields) VALUES (?, ?, ?)", rows)
+
+    def add_alias(self, surface, headword, entry_id=None):
+        """ remember that the highlighted form `surface` (e.g. 'ran') resolved to `headword` ('run') """
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO aliases (surface, headword, entry_id) VALUES (?, ?, ?)",
+                             (surface, headword, entry_id))
+
+    def resolve_alias(self, surface):
+        """ headword a surface form resolved to before, or None """
+        with self._lock:
+            row = self._db.execute("SELECT headword FROM aliases WHERE surface = ?", (surface,)).fetchone()
+        return row[0] if row is not None else None
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,113 @@
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import tempfile
+import time
+import zipfile
+import zlib
+
+from genanki import Deck, Note
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+
+SOUND_PATTERN = re.compile(r"\[sound:([^\]]+)\]")
+
+
+def sub_deck_id(deck_id, shard):
+    """ stable id of the sub-deck `shard` below deck_id """
+    return deck_id if not shard else (deck_id + zlib.crc32(shard.encode("utf8"))) % (1 << 31)
+
+
+class StreamingDeckWriter:
+    """
+    Writes an .apkg without holding the deck in memory, unlike genanki.Package: notes are inserted into the
+    collection database in batches of `batch_size`. Instead of shuffling a list of notes, every note gets a random
+    due position and the positions are renumbered in the database at the end. Media referenced by [sound:...] in the
+    note fields are taken from `media_directory`.
+    """
+
+    def __init__(self, path, deck_id, deck_name, models, media_directory=None, batch_size=1000, seed=None):
+        self.path = path
+        self.deck_id = deck_id
+        self.media_directory = media_directory
+        self.batch_size = batch_size
+        self.notes = 0
+        self.media = set()
+        self._random = random.Random(seed)
+        self._batch = []
+        self._timestamp = time.time()
+        self._id_gen = itertools.count(int(self._timestamp * 1000))
+        handle, self._db_path = tempfile.mkstemp(suffix=".anki2", dir=os.path.dirname(os.path.abspath(path)))
+        os.close(handle)
+        self._db = sqlite3.connect(self._db_path)
+        cursor = self._db.cursor()
+        cursor.executescript(APKG_SCHEMA)
+        cursor.executescript(APKG_COL)
+        # an empty deck writes the deck and model configuration
+        deck = Deck(deck_id, deck_name)
+        for model in models:
+            deck.add_model(model)
+        deck.write_to_db(cursor, self._timestamp, self._id_gen)
+
+    def add(self, model, fields):
+        self._batch.append(Note(model=model, fields=list(fields), due=self._random.getrandbits(31)))
+        for field in fields:
+            self.media.update(SOUND_PATTERN.findall(field))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        cursor = self._db.cursor()
+        for note in self._batch:
+            note.write_to_db(cursor, self._timestamp, self.deck_id, self._id_gen)
+        self._db.commit()
+        self.notes += len(self._batch)
+        self._batch = []
+
+    def _renumber_due(self):
+        # random keys -> new card positions 0..n-1, the order Anki shows new cards in
+        self._db.executescript("""
+            CREATE TEMP TABLE card_order (id INTEGER PRIMARY KEY, position INTEGER);
+            INSERT INTO card_order SELECT id, ROW_NUMBER() OVER (ORDER BY due, id) - 1 FROM cards;
+            UPDATE cards SET due = (SELECT position FROM card_order WHERE card_order.id = cards.id);
+            DROP TABLE card_order;
+        """)
+        self._db.commit()
+
+    def close(self):
+        """ finish the collection and write the .apkg; :return: number of referenced media files not found """
+        self.flush()
+        self._renumber_due()
+        self._db.close()
+        media_files = []
+        if self.media_directory is not None:
+            media_files = [os.path.join(self.media_directory, filename) for filename in sorted(self.media)
+                           if os.path.exists(os.path.join(self.media_directory, filename))]
+        try:
+            with zipfile.ZipFile(self.path + ".tmp", "w") as package:
+                package.write(self._db_path, "collection.anki2")
+                package.writestr("media", json.dumps({index: os.path.basename(path)
+                                                      for index, path in enumerate(media_files)}))
+                for index, path in enumerate(media_files):
+                    package.write(path, str(index))
+            os.replace(self.path + ".tmp", self.path)
+        finally:
+            os.remove(self._db_path)
+        return len(self.media) - len(media_files)
+
+
+def write_deck(spill_path, path, deck_id, deck_name, models, media_directory=None, batch_size=1000):
+    """
+    write an .apkg from a spill file of json lines [model index, fields]
+    :return: (path, notes, missing media files)
+    """
+    writer = StreamingDeckWriter(path, deck_id, deck_name, models, media_directory, batch_size)
+    with open(spill_path, "r", encoding="utf8") as spill:
+        for line in spill:
+            model_index, fields = json.loads(line)
+            writer.add(models[model_index], fields)
+    missing = writer.close()
+    return path, writer.notes, missing
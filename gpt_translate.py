@@ -1,14 +1,20 @@
+import asyncio
+import hashlib
+import json
 import os
+import re
+import threading
 
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIConnectionError, InternalServerError
+
+from metrics import metrics
+from throttle import AsyncRequestTokenLimiter
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
-def translate_en_to_de_with_definition(word, context, definition):
-    completion = client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
-            {"role": "system", "content": """You are a translator that helps translate english words to german based on the context. 
+MODEL = "gpt-4o"
+
+SYSTEM_PROMPT = """You are a translator that helps translate english words to german based on the context. 
             Your input will consist of a tuple of the english word, an optional context, and a definition. 
             Your output will just consist of german words that you think best represent the english word in the given context, separated by a comma.
             Example 1:
@@ -20,13 +26,262 @@ def translate_en_to_de_with_definition(word, context, definition):
             Example 3:
                 Input: ("curmudgeon", "", "a person who gets annoyed easily, often an old person")
                 Output: "Miesepeter, Muffel, Griesgram"
-            """},
-            {
-                "role": "user",
-                "content": f"(\"{word}\", \"{context}\", \"{definition}\")"
-            }
-        ]
-    )
+            """
+
+BATCH_SYSTEM_PROMPT = """You are a translator that helps translate english words to german based on the context.
+            Your input will be a JSON list of objects with the english "word", an optional "context", and a "definition".
+            For every object, find the german words that best represent the english word in the given context, separated by a comma.
+            Answer with a JSON object {"translations": [...]} holding exactly one string per input object, in input order.
+            Example:
+                Input: [{"word": "game", "context": "fun", "definition": "an activity that you do to have fun, often one that has rules and that you can win or lose; the equipment for a game"},
+                        {"word": "game", "context": "wild animals/birds", "definition": "wild animals or birds that people hunt for sport or food"},
+                        {"word": "curmudgeon", "context": "", "definition": "a person who gets annoyed easily, often an old person"}]
+                Output: {"translations": ["Spiel", "Wild, Jagdfauna", "Miesepeter, Muffel, Griesgram"]}
+            """
+
+
+# cached translations are only reused for the same model and prompts
+PROMPT_VERSION = f"{MODEL}:{hashlib.sha256((SYSTEM_PROMPT + BATCH_SYSTEM_PROMPT).encode("utf8")).hexdigest()[:12]}"
+
+
+class MalformedBatchResponse(ValueError):
+    """ batch translation response does not contain one translation per requested definition """
+    pass
+
+
+def _single_messages(word, context, definition):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": f"(\"{word}\", \"{context}\", \"{definition}\")"
+        }
+    ]
+
+
+def _batch_messages(batch):
+    return [
+        {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": json.dumps([{"word": word, "context": context, "definition": definition}
+                                   for word, context, definition in batch], ensure_ascii=False)
+        }
+    ]
+
+
+def _record_usage(completion):
+    metrics.increment("translate_requests_total")
+    if completion.usage is not None:
+        metrics.increment("translate_prompt_tokens_total", completion.usage.prompt_tokens)
+        metrics.increment("translate_completion_tokens_total", completion.usage.completion_tokens)
+
+
+def translate_en_to_de_with_definition(word, context, definition):
+    with metrics.timer("translate_request_seconds"):
+        completion = client.chat.completions.create(
+            model=MODEL,
+            messages=_single_messages(word, context, definition)
+        )
+    _record_usage(completion)
 
     return completion.choices[0].message.content.replace('"', '')
 
+
+def translate_definitions(items, batch_size=20, cache=None):
+    """
+    Translates a list of (word, context, definition) tuples with one request per batch
+    :param items: the (word, context, definition) tuples, possibly of several words
+    :param batch_size: maximum number of definitions sent in one request
+    :param cache: optional TranslationCache consulted before and filled after the requests
+    :return: the german translations in the order of items
+    """
+    translations = [cache.get(*item) if cache is not None else None for item in items]
+    missing = [i for i, translation in enumerate(translations) if translation is None]
+    for start in range(0, len(missing), batch_size):
+        indices = missing[start:start + batch_size]
+        batch = [items[i] for i in indices]
+        if len(batch) == 1:
+            batch_translations = [translate_en_to_de_with_definition(*batch[0])]
+        else:
+            try:
+                batch_translations = _translate_batch(batch)
+            except MalformedBatchResponse:
+                metrics.increment("translate_batch_fallbacks_total")
+                batch_translations = [translate_en_to_de_with_definition(*item) for item in batch]
+        for i, translation in zip(indices, batch_translations):
+            translations[i] = translation
+            if cache is not None:
+                cache.put(*items[i], translation)
+    return translations
+
+
+def _translate_batch(batch):
+    with metrics.timer("translate_request_seconds"):
+        completion = client.chat.completions.create(
+            model=MODEL,
+            response_format={"type": "json_object"},
+            messages=_batch_messages(batch)
+        )
+    _record_usage(completion)
+    return _parse_batch_response(completion.choices[0].message.content, len(batch))
+
+
+def _parse_batch_response(content, expected_length):
+    try:
+        translations = json.loads(content)["translations"]
+    except (json.JSONDecodeError, KeyError, TypeError) as e:
+        raise MalformedBatchResponse(f"Could not read translations from response: {content!r}") from e
+    if not isinstance(translations, list) or len(translations) != expected_length:
+        raise MalformedBatchResponse(f"Expected {expected_length} translations, got: {translations!r}")
+    if not all(isinstance(translation, str) and translation.strip() for translation in translations):
+        raise MalformedBatchResponse(f"Empty or non-string translation in: {translations!r}")
+    return [translation.replace('"', '').strip() for translation in translations]
+
+
+def _parse_duration(value):
+    """ parse rate limit reset values like '1s', '6m0s' or '20ms' into seconds """
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    return sum(float(amount) * units[unit] for amount, unit in parts) if parts else None
+
+
+def _retry_after(headers):
+    """ seconds the server asks us to wait, from retry-after(-ms) or the rate limit reset headers """
+    if "retry-after-ms" in headers:
+        return float(headers["retry-after-ms"]) / 1000
+    waits = [_parse_duration(headers.get(name)) for name in
+             ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")]
+    waits = [wait for wait in waits if wait is not None]
+    return max(waits) if waits else None
+
+
+class AsyncTranslator:
+    """
+    Translates definitions on the async OpenAI client with at most `max_concurrency` requests in flight,
+    throttled to the account's requests and tokens per minute, or the lower limits the server reports. 429 responses
+    pause all requests for as long as the server asks, but at least for a backoff that doubles with every attempt.
+    Point `base_url` at a local stub to load-test without the real API.
+    Synchronous callers (e.g. worker threads) use translate_definitions_sync, which runs on a background event loop.
+    """
+
+    def __init__(self, max_concurrency=8, requests_per_minute=500, tokens_per_minute=30000, batch_size=20,
+                 max_retries=5, base_url=None, api_key=None):
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_url = base_url
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.limiter = AsyncRequestTokenLimiter(requests_per_minute, tokens_per_minute)
+        self.retries = 0
+        self.rate_limited = 0
+        self.tokens_used = 0
+        self._client = None
+        self._semaphore = None
+        self._loop = None
+        self._loop_lock = threading.Lock()
+
+    def _ensure_client(self):
+        # created lazily so the client and semaphore belong to the loop they are used on
+        if self._client is None:
+            # we retry ourselves so 429s reach the limiter
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    @staticmethod
+    def _estimate_tokens(messages, expected_items):
+        # ~4 characters per token for the prompt plus a small answer per item
+        return sum(len(message["content"]) for message in messages) // 4 + 16 * expected_items
+
+    async def _complete(self, messages, expected_items, **kwargs):
+        self._ensure_client()
+        estimate = self._estimate_tokens(messages, expected_items)
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore:
+                await self.limiter.acquire(estimate)
+                try:
+                    with metrics.timer("translate_request_seconds"):
+                        raw = await self._client.chat.completions.with_raw_response.create(
+                            model=MODEL, messages=messages, **kwargs)
+                except RateLimitError as e:
+                    if attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    self.rate_limited += 1
+                    metrics.increment("translate_rate_limited_total")
+                    self._update_limits(e.response.headers)
+                    self.limiter.pause(max(_retry_after(e.response.headers) or 0, self._backoff(attempt)))
+                    continue
+                except (APIConnectionError, InternalServerError):
+                    if attempt == self.max_retries:
+                        raise
+                    self.retries += 1
+                    metrics.increment("translate_retries_total")
+                    await asyncio.sleep(self._backoff(attempt))
+                    continue
+            self._update_limits(raw.headers)
+            remaining_requests = raw.headers.get("x-ratelimit-remaining-requests")
+            remaining_tokens = raw.headers.get("x-ratelimit-remaining-tokens")
+            self.limiter.update(int(remaining_requests) if remaining_requests else None,
+                                int(remaining_tokens) if remaining_tokens else None)
+            completion = raw.parse()
+            _record_usage(completion)
+            if completion.usage is not None:
+                self.tokens_used += completion.usage.total_tokens
+                self.limiter.adjust(completion.usage.total_tokens - estimate)
+            return completion.choices[0].message.content
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(2 ** attempt * 0.5, 30)
+
+    def _update_limits(self, headers):
+        limit_requests = headers.get("x-ratelimit-limit-requests")
+        limit_tokens = headers.get("x-ratelimit-limit-tokens")
+        self.limiter.lower_limits(int(limit_requests) if limit_requests else None,
+                                  int(limit_tokens) if limit_tokens else None)
+
+    async def translate_one(self, word, context, definition):
+        content = await self._complete(_single_messages(word, context, definition), 1)
+        return content.replace('"', '')
+
+    async def _translate_batch(self, batch):
+        if len(batch) == 1:
+            return [await self.translate_one(*batch[0])]
+        content = await self._complete(_batch_messages(batch), len(batch), response_format={"type": "json_object"})
+        try:
+            return _parse_batch_response(content, len(batch))
+        except MalformedBatchResponse:
+            metrics.increment("translate_batch_fallbacks_total")
+            return list(await asyncio.gather(*(self.translate_one(*item) for item in batch)))
+
+    async def translate_definitions(self, items, cache=None):
+        """ async counterpart of translate_definitions; batches are sent concurrently """
+        translations = [cache.get(*item) if cache is not None else None for item in items]
+        missing = [i for i, translation in enumerate(translations) if translation is None]
+        batches = [missing[start:start + self.batch_size] for start in range(0, len(missing), self.batch_size)]
+        results = await asyncio.gather(*(self._translate_batch([items[i] for i in indices]) for indices in batches))
+        for indices, batch_translations in zip(batches, results):
+            for i, translation in zip(indices, batch_translations):
+                translations[i] = translation
+                if cache is not None:
+                    cache.put(*items[i], translation)
+        return translations
+
+    def translate_definitions_sync(self, items, cache=None):
+        """ blocking wrapper that can be called from any thread; all callers share one event loop """
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="translator-loop", daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.translate_definitions(items, cache), self._loop).result()
+
+    @property
+    def stats(self):
+        return {"retries": self.retries, "rate_limited": self.rate_limited, "tokens_used": self.tokens_used}
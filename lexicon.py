@@ -0,0 +1,164 @@
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from urllib.parse import urlsplit, parse_qs
+
+from metrics import metrics
+from oxford import Word
+from page_cache import PageCache
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.DEBUG)
+
+# bump whenever Word extraction, dictionary_entry or the tables change so lexicons built by older versions are
+# discarded
+LEXICON_VERSION = "3"
+
+
+def dictionary_entry(word_info):
+    """ the part of a Word the deck needs, as AnkiDeckGenerator.scrape_dictionary returns it """
+    ipa = audio_url = None
+    if word_info.pronunciations:
+        for pron in word_info.pronunciations:
+            if pron["prefix"] == "nAmE":
+                ipa, audio_url = pron["ipa"], pron["url"]
+                break
+        else:
+            ipa, audio_url = word_info.pronunciations[0]["ipa"], word_info.pronunciations[0]["url"]
+    definitions = word_info.definition_full
+    return {"ipa": ipa, "audio_url": audio_url, "definitions": definitions, "word": word_info.name,
+            "id": word_info.id, "word_form": word_info.wordform, "homograph_ids": word_info.homograph_ids}
+
+
+def lookup_key(url):
+    """ 'q:<word>' for search urls, 'id:<entry id>' for definition urls, None for anything else """
+    parts = urlsplit(url)
+    if parts.path.endswith("/search/english/direct/"):
+        words = parse_qs(parts.query).get("q")
+        return f"q:{words[0]}" if words else None
+    if "/definition/english/" in parts.path:
+        return f"id:{parts.path.rsplit('/', 1)[-1]}"
+    return None
+
+
+def _extract_page(page):
+    """ (url, html, fetched at) -> (lookup key, dictionary entry or None, fetched at) """
+    url, content, fetched_at = page
+    try:
+        return lookup_key(url), dictionary_entry(Word.from_html(content)), fetched_at
+    except (IndexError, KeyError, AttributeError):
+        # not an entry page, e.g. a search result list
+        return lookup_key(url), None, fetched_at
+
+
+class Lexicon:
+    """
+    SQLite index of extracted dictionary entries, keyed by entry id and by every search word and url id that led
+    to them. Built once from the page cache (see build), it answers lookups without fetching or parsing any html.
+    Every entry keeps the time its page was fetched, so lookups can apply the page cache's ttl.
+    """
+
+    def __init__(self, path="data/lexicon.sqlite"):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is None or row[0] != LEXICON_VERSION:
+                self._db.execute("DROP TABLE IF EXISTS entries")
+                self._db.execute("DROP TABLE IF EXISTS lookups")
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (LEXICON_VERSION,))
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries "
+                             "(id TEXT PRIMARY KEY, data TEXT NOT NULL, fetched_at REAL NOT NULL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS lookups (key TEXT PRIMARY KEY, entry_id TEXT NOT NULL)")
+
+    def get(self, word=None, word_id=None, max_age=None):
+        """
+        the stored dictionary entry for a search word or an entry id, or None
+        :param max_age: seconds after which an entry counts as missing, e.g. the page cache's ttl
+        """
+        key = f"q:{word}" if word is not None else f"id:{word_id}"
+        with self._lock:
+            row = self._db.execute("SELECT entries.data, entries.fetched_at FROM lookups "
+                                   "JOIN entries ON entries.id = lookups.entry_id WHERE lookups.key = ?",
+                                   (key,)).fetchone()
+            if row is None and word_id is not None:
+                row = self._db.execute("SELECT data, fetched_at FROM entries WHERE id = ?", (word_id,)).fetchone()
+            if row is not None and max_age is not None and time.time() - row[1] > max_age:
+                # stale; the caller fetches the page again and put replaces the entry
+                row = None
+            if row is None:
+                self.misses += 1
+                metrics.increment("lexicon_misses_total")
+                return None
+            self.hits += 1
+            metrics.increment("lexicon_hits_total")
+        # a fresh dict per call, callers add translations to it
+        return json.loads(row[0])
+
+    def put(self, entry, word=None, word_id=None, fetched_at=None):
+        """
+        store an entry and remember the search word or url id it was looked up by
+        :param fetched_at: when its page was fetched, now by default
+        """
+        self.put_many([(f"q:{word}" if word is not None else f"id:{word_id}", entry,
+                        fetched_at if fetched_at is not None else time.time())])
+
+    def put_many(self, items):
+        """ store (lookup key, entry, fetched at) triples in one transaction """
+        with self._lock, self._db:
+            for key, entry, fetched_at in items:
+                self._db.execute("INSERT OR REPLACE INTO entries (id, data, fetched_at) VALUES (?, ?, ?)",
+                                 (entry["id"], json.dumps(entry, ensure_ascii=False), fetched_at))
+                if key is not None:
+                    self._db.execute("INSERT OR REPLACE INTO lookups (key, entry_id) VALUES (?, ?)",
+                                     (key, entry["id"]))
+
+    def build(self, page_cache, processes=None, chunk_size=64):
+        """
+        extract every page of page_cache into the lexicon, spread over `processes` worker processes
+        :return: number of pages indexed
+        """
+        indexed = 0
+        pages = page_cache.iter_pages()
+        with ProcessPoolExecutor(processes) as pool:
+            # hand the pool a bounded wave of pages at a time; map would read the whole cache into memory first
+            wave_size = chunk_size * 2 * (processes or os.cpu_count() or 1)
+            while wave := list(islice(pages, wave_size)):
+                entries = [result for result in pool.map(_extract_page, wave, chunksize=chunk_size)
+                           if result[1] is not None]
+                self.put_many(entries)
+                indexed += len(entries)
+        return indexed
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Build the lexicon from the cached dictionary pages.")
+    arg_parser.add_argument("--page-cache", default="data/page_cache")
+    arg_parser.add_argument("--lexicon", default="data/lexicon.sqlite")
+    arg_parser.add_argument("--processes", type=int, default=None, help="extraction processes (default: one per CPU)")
+    args = arg_parser.parse_args()
+
+    start = time.perf_counter()
+    lexicon = Lexicon(args.lexicon)
+    pages = lexicon.build(PageCache(args.page_cache), args.processes)
+    logger.info(f"Indexed {pages} pages ({len(lexicon)} entries) in {time.perf_counter() - start:.1f} s.")
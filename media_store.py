@@ -0,0 +1,112 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import Future
+
+import requests
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.DEBUG)
+
+
+class MediaStore:
+    """
+    Downloaded media (pronunciation recordings) for the deck, stored content-addressed: every file is named by the
+    sha256 of its bytes, which is also the name Anki sees, so a recording reached through several urls is stored and
+    packaged once. Urls are remembered with the file they resolved to (or that they do not exist) and are never
+    downloaded again; concurrent requests for the same url share one download. In `offline` mode only stored
+    files are returned.
+    """
+
+    def __init__(self, directory="data/media", transport=None, offline=False):
+        self.directory = directory
+        self.transport = transport
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._inflight = {}
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        with self._db:
+            # filename is NULL for urls the server answered with 404
+            self._db.execute("CREATE TABLE IF NOT EXISTS media (url TEXT PRIMARY KEY, filename TEXT)")
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _lookup(self, url):
+        """ (known, filename) """
+        row = self._db.execute("SELECT filename FROM media WHERE url = ?", (url,)).fetchone()
+        if row is None or (row[0] is not None and not os.path.exists(self.path(row[0]))):
+            return False, None
+        return True, row[0]
+
+    def fetch(self, url):
+        """ filename of the stored file for url, downloading it first if needed; None if it is not available """
+        with self._lock:
+            known, filename = self._lookup(url)
+            if known:
+                metrics.increment("media_hits_total")
+                return filename
+            if self.offline or self.transport is None:
+                return None
+            future = self._inflight.get(url)
+            owner = future is None
+            if owner:
+                future = self._inflight[url] = Future()
+        if not owner:
+            return future.result()
+        metrics.increment("media_misses_total")
+        try:
+            try:
+                filename = self._download(url)
+            except requests.RequestException as e:
+                # not remembered, so a later run tries again
+                logger.warning(f"Could not download {url}: {e}")
+                filename = None
+            future.set_result(filename)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[url]
+        return filename
+
+    def _download(self, url):
+        response = self.transport.get(url, timer="media_fetch_seconds")
+        if response.status_code == 404:
+            with self._lock, self._db:
+                self._db.execute("INSERT OR REPLACE INTO media (url, filename) VALUES (?, NULL)", (url,))
+            return None
+        response.raise_for_status()
+        content = response.content
+        extension = os.path.splitext(url.split("?")[0])[1] or ".bin"
+        filename = hashlib.sha256(content).hexdigest() + extension
+        path = self.path(filename)
+        if not os.path.exists(path):
+            # a temporary file of its own, two urls with the same recording may be downloaded at the same time
+            handle, temporary_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+            try:
+                with os.fdopen(handle, "wb") as file:
+                    file.write(content)
+                os.replace(temporary_path, path)
+            except BaseException:
+                os.remove(temporary_path)
+                raise
+            metrics.increment("media_bytes_total", len(content))
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO media (url, filename) VALUES (?, ?)", (url, filename))
+        return filename
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(DISTINCT filename) FROM media").fetchone()[0]
+
+    def close(self):
+        self._db.close()
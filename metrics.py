@@ -0,0 +1,225 @@
+import bisect
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds; wide enough for both a parsed page (ms) and a throttled GPT request (s)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """ cumulative-bucket histogram like Prometheus keeps it, plus min and max """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """ upper bound of the bucket holding the q-th observation (max for the overflow bucket) """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        return {"count": self.count, "sum": self.sum, "min": self.min, "max": self.max,
+                "mean": self.sum / self.count if self.count else None,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, gauges and latency histograms for one generator run.
+    Counters named <name>_hits_total / <name>_misses_total are reported as a hit rate as well.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name):
+        """ observe the wall time of the block in histogram `name`, also if it raises """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def hit_rates(self):
+        rates = {}
+        for name, hits in self.counters.items():
+            if not name.endswith("_hits_total"):
+                continue
+            prefix = name[:-len("_hits_total")]
+            lookups = hits + self.counters.get(prefix + "_misses_total", 0)
+            rates[prefix] = hits / lookups if lookups else 0.0
+        return rates
+
+    def to_dict(self):
+        with self._lock:
+            return {"started": self.started, "elapsed_seconds": time.time() - self.started,
+                    "counters": dict(self.counters), "gauges": dict(self.gauges), "hit_rates": self.hit_rates(),
+                    "histograms": {name: histogram.summary() for name, histogram in self.histograms.items()}}
+
+    def to_prometheus(self):
+        """ text exposition format, e.g. for the node exporter's textfile collector """
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines += [f"# TYPE {name} counter", f"{name} {value}"]
+            for name, value in sorted(self.gauges.items()):
+                lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+            for name, histogram in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{le="+Inf"}} {histogram.count}')
+                lines += [f"{name}_sum {histogram.sum}", f"{name}_count {histogram.count}"]
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        """ write the summary to path: Prometheus text for *.prom, JSON otherwise """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf8") as file:
+            if path.endswith(".prom"):
+                file.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), file, indent=2)
+
+
+# registry every module reports to
+metrics = Metrics()
+
+
+class StackSampler:
+    """
+    Statistical profiler for every thread: samples the stacks of all threads every `interval` seconds. cProfile
+    cannot do this, it follows one stack per interpreter, so the work of the pipeline threads would be missing or
+    mixed up. The samples are kept in the format of cProfile's stats, so pstats and snakeviz can read them; times
+    are wall time per thread (a thread waiting on a queue or a socket counts as well), call counts are sample counts.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stats = {}
+        # function -> [samples, seconds, seconds as leaf, {caller: [samples, seconds, seconds as leaf]}]
+        self._samples = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            # a sample stands for the time since the previous one, which is longer than interval under load
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            for ident, frame in sys._current_frames().items():
+                if ident != self._thread.ident:
+                    self._sample(frame, elapsed)
+
+    def _sample(self, frame, elapsed):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+            frame = frame.f_back
+        seen = set()
+        for depth, function in enumerate(stack):
+            record = self._samples.setdefault(function, [0, 0.0, 0.0, {}])
+            if function not in seen:
+                # a recursive function is on the stack more than once but spends the time once
+                seen.add(function)
+                record[0] += 1
+                record[1] += elapsed
+            if depth == 0:
+                record[2] += elapsed
+            if depth + 1 < len(stack):
+                caller = record[3].setdefault(stack[depth + 1], [0, 0.0, 0.0])
+                caller[0] += 1
+                caller[1] += elapsed
+                if depth == 0:
+                    caller[2] += elapsed
+
+    def create_stats(self):
+        """ (calls, primitive calls, own time, cumulative time, callers) per function, as pstats expects """
+        self.stats = {function: (samples, samples, own, cumulative,
+                                 {caller: (count, count, caller_own, caller_cumulative)
+                                  for caller, (count, caller_cumulative, caller_own) in callers.items()})
+                      for function, (samples, cumulative, own, callers) in self._samples.items()}
+
+
+@contextmanager
+def profiled(path=None, top=25, interval=0.005):
+    """
+    sample the stacks of all threads while the block runs (see StackSampler); the stats are written to `path` (for
+    snakeviz or pstats) if given
+    :return: yields an io.StringIO that holds the `top` functions by cumulative time once the block is done
+    """
+    sampler = StackSampler(interval)
+    report = io.StringIO()
+    sampler.start()
+    try:
+        yield report
+    finally:
+        sampler.stop()
+        stats = pstats.Stats(sampler, stream=report)
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            stats.dump_stats(path)
+        stats.sort_stats("cumulative").print_stats(top)
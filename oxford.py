@@ -1,10 +1,18 @@
 #!/bin/env python3
 
 """ oxford dictionary api """
+import copy
+import re
+import threading
 from http import cookiejar
+from typing import NamedTuple, Optional
 
 import requests
-from bs4 import BeautifulSoup as soup
+from bs4 import BeautifulSoup as soup, SoupStrainer
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from metrics import metrics
 
 
 class WordNotFound(Exception):
@@ -19,6 +27,22 @@ class BlockAll(cookiejar.CookiePolicy):
     rfc2965 = hide_cookie2 = False
 
 
+class WordEntry(NamedTuple):
+    """ everything extracted from one dictionary page, built in a single pass by Word._extract """
+    id: str
+    name: str
+    wordform: Optional[str]
+    property_global: Optional[str]
+    pronunciations: list
+    references: list
+    definitions: list
+    examples: list
+    phrasal_verbs: list
+    definition_full: list
+    idioms: list
+    other_results: Optional[list]
+
+
 class Word:
     """ retrieve word info from oxford dictionary website """
     entry_selector = '#entryContent > .entry'
@@ -49,36 +73,81 @@ class Word:
 
     other_results_selector = '#rightcolumn #relatedentries'
 
-    def __init__(self, word, by_id=False):
+    # scheme and host the pages are requested from, e.g. a local stand-in server for load tests
+    base_url = 'https://www.oxfordlearnersdictionaries.com'
+
+    removed_boxes_selector = ', '.join(f'[title="{title}"]' for title in (
+        'Oxford Collocations Dictionary',
+        'British/American',  # edge case: 'phone'
+        'Express Yourself',
+        'Collocations',
+        'Word Origin',
+    ))
+    pronunciation_selector = '[geo=br], [geo=n_am]'
+
+    # tree builder for BeautifulSoup, e.g. 'lxml' when installed; only the subtrees we read are materialized
+    html_parser = 'html.parser'
+    parse_only = SoupStrainer(id=['entryContent', 'rightcolumn'])
+
+    def __init__(self, word, by_id=False, transport=None, cache=None):
         # URL-encode the word
         self.word = requests.utils.quote(word)
         self.soup_data = None
+        self._entry = None
+        self.transport = transport if transport is not None else get_default_transport()
+        self.cache = cache
         self._fetch_data(by_id)
 
-    def _fetch_data(self, by_id=False):
-        req = requests.Session()
-        req.cookies.set_policy(BlockAll())
+    @classmethod
+    def from_html(cls, content, word=''):
+        """ build a Word from an already fetched page without going to the network """
+        instance = cls.__new__(cls)
+        instance.word = requests.utils.quote(word)
+        instance.soup_data = None
+        instance._entry = None
+        instance.transport = None
+        instance.cache = None
+        instance._parse(content)
+        return instance
 
-        page_html = req.get(self.get_url(by_id), timeout=5, headers={'User-agent': self.user_agent})
-        if page_html.status_code == 404:
-            raise WordNotFound
-        else:
-            self.soup_data = soup(page_html.content, 'html.parser')
+    def _fetch_data(self, by_id=False):
+        url = self.get_url(by_id)
+        content = self.cache.get(url) if self.cache is not None else None
+        if self.cache is not None:
+            metrics.increment("page_cache_hits_total" if content is not None else "page_cache_misses_total")
+        if content is None:
+            if self.cache is not None and self.cache.offline:
+                raise WordNotFound
+            page_html = self.transport.get(url)
+            metrics.increment("oxford_requests_total")
+            if page_html.status_code == 404:
+                metrics.increment("oxford_not_found_total")
+                raise WordNotFound
+            # a 429 or 5xx page left over after the retries is an error, not an entry to parse and cache
+            page_html.raise_for_status()
+            content = page_html.content
+            # only entries are cached, anything else would be served to every later and offline run
+            if self.cache is not None and 200 <= page_html.status_code < 300:
+                self.cache.put(url, content)
+        self._parse(content)
+
+    def _parse(self, content):
+        with metrics.timer("oxford_parse_seconds"):
+            self.soup_data = soup(content, self.html_parser, parse_only=self.parse_only)
+        self._entry = None
 
         if self.soup_data is not None:
             self._clean_soup()
 
     def _clean_soup(self):
-        self.delete('[title="Oxford Collocations Dictionary"]')
-        self.delete('[title="British/American"]')  # edge case: 'phone'
-        self.delete('[title="Express Yourself"]')
-        self.delete('[title="Collocations"]')
-        self.delete('[title="Word Origin"]')
+        # one pass over the tree for all boxes we never read
+        for tag in self.soup_data.select(self.removed_boxes_selector):
+            if not tag.decomposed:
+                tag.decompose()
 
     def get_url(self, by_id):
-        baseurl = 'https://www.oxfordlearnersdictionaries.com/search/english/direct/?q=' \
-            if not by_id else 'https://www.oxfordlearnersdictionaries.com/definition/english/'
-        return baseurl + self.word
+        path = '/search/english/direct/?q=' if not by_id else '/definition/english/'
+        return self.base_url + path + self.word
 
     def delete(self, selector):
         try:
@@ -88,34 +157,62 @@ class Word:
             pass
 
     @property
-    def name(self):
+    def entry(self):
+        """ immutable extraction result all properties read from, computed once on first access """
         if self.soup_data is None:
             return None
-        return self.soup_data.select(self.title_selector)[0].text
+        if self._entry is None:
+            with metrics.timer("oxford_extract_seconds"):
+                self._entry = self._extract()
+        return self._entry
+
+    def _extract(self):
+        entry_tag = self.soup_data.select(self.entry_selector)[0]
+        header_tag = entry_tag.select(self.header_selector)[0]
+        phrasal_verbs = self._extract_phrasal_verbs(entry_tag)
+
+        return WordEntry(
+            id=entry_tag.attrs['id'],
+            name=entry_tag.select(self.title_selector)[0].text,
+            wordform=self._first_text(entry_tag, self.wordform_selector),
+            property_global=self._first_text(entry_tag, self.property_global_selector),
+            pronunciations=self._extract_pronunciations(entry_tag),
+            references=self.get_references(header_tag),
+            definitions=[tag.text for tag in entry_tag.select(self.definitions_selector)],
+            examples=[tag.text for tag in entry_tag.select(self.examples_selector)],
+            phrasal_verbs=phrasal_verbs,
+            definition_full=self._extract_definition_full(entry_tag, phrasal_verbs),
+            idioms=self._extract_idioms(entry_tag),
+            other_results=self._extract_other_results(),
+        )
+
+    @staticmethod
+    def _first_text(parent_tag, selector):
+        tag = parent_tag.select_one(selector)
+        return tag.text if tag is not None else None
+
+    def _field(self, name):
+        entry = self.entry
+        if entry is None:
+            return None
+        # hand out copies so callers (e.g. adding translations) cannot change the memoized entry
+        return copy.deepcopy(getattr(entry, name))
+
+    @property
+    def name(self):
+        return self._field('name')
 
     @property
     def id(self):
-        if self.soup_data is None:
-            return None
-        return self.soup_data.select(self.entry_selector)[0].attrs['id']
+        return self._field('id')
 
     @property
     def wordform(self):
-        if self.soup_data is None:
-            return None
-        try:
-            return self.soup_data.select(self.wordform_selector)[0].text
-        except IndexError:
-            return None
+        return self._field('wordform')
 
     @property
     def property_global(self):
-        if self.soup_data is None:
-            return None
-        try:
-            return self.soup_data.select(self.property_global_selector)[0].text
-        except IndexError:
-            return None
+        return self._field('property_global')
 
     def get_prefix_from_filename(self, filename):
         if '_gb_' in filename:
@@ -126,28 +223,36 @@ class Word:
 
     @property
     def pronunciations(self):
-        if self.soup_data is None:
-            return None
+        return self._field('pronunciations')
 
+    def _extract_pronunciations(self, entry_tag):
         britain = {'prefix': None, 'ipa': None, 'url': None}
         america = {'prefix': None, 'ipa': None, 'url': None}
 
-        try:
-            britain_pron_tag = self.soup_data.select(self.br_pronounce_selector)[0]
-            america_pron_tag = self.soup_data.select(self.am_pronounce_selector)[0]
+        geo_tags = entry_tag.select(self.pronunciation_selector)
+
+        def first(geo, selector):
+            for geo_tag in geo_tags:
+                if geo_tag.get('geo') == geo:
+                    tag = geo_tag.select_one(selector)
+                    if tag is not None:
+                        return tag
+            return None
 
+        britain_pron_tag = first('br', '.phon')
+        america_pron_tag = first('n_am', '.phon')
+        if britain_pron_tag is not None and america_pron_tag is not None:
             britain['ipa'] = britain_pron_tag.text
             britain['prefix'] = 'BrE'
             america['ipa'] = america_pron_tag.text
             america['prefix'] = 'nAmE'
-        except IndexError:
-            pass
 
-        try:
-            britain['url'] = self.soup_data.select(self.br_pronounce_audio_selector)[0].attrs['data-src-ogg']
-            america['url'] = self.soup_data.select(self.am_pronounce_audio_selector)[0].attrs['data-src-ogg']
-        except IndexError:
-            pass
+        britain_audio_tag = first('br', '[data-src-ogg]')
+        if britain_audio_tag is not None:
+            britain['url'] = britain_audio_tag.attrs['data-src-ogg']
+            america_audio_tag = first('n_am', '[data-src-ogg]')
+            if america_audio_tag is not None:
+                america['url'] = america_audio_tag.attrs['data-src-ogg']
 
         if britain['prefix'] is None and britain['url'] is not None:
             britain['prefix'] = self.get_prefix_from_filename(britain['url'])
@@ -159,9 +264,9 @@ class Word:
 
     @property
     def other_results(self):
-        if self.soup_data is None:
-            return None
+        return self._field('other_results')
 
+    def _extract_other_results(self):
         info = []
 
         try:
@@ -202,6 +307,26 @@ class Word:
 
         return info
 
+    @property
+    def homograph_ids(self):
+        """ ids of the other numbered entries of this headword (e.g. run_2, run_3 for run_1) from the related entries """
+        entry = self.entry
+        if entry is None or not entry.other_results:
+            return []
+        stem, _, number = entry.id.rpartition('_')
+        if not stem or not number.isdigit():
+            return []
+        pattern = re.compile(rf'{re.escape(stem)}_(\d+)')
+        numbers = set()
+        for group in entry.other_results:
+            for results in group.values():
+                for result in results:
+                    match = pattern.fullmatch(result['id'])
+                    if match:
+                        numbers.add(int(match.group(1)))
+        numbers.discard(int(number))
+        return [f'{stem}_{n}' for n in sorted(numbers)]
+
     def extract_id(self, link):
         return link.split('/')[-1]
 
@@ -219,31 +344,23 @@ class Word:
 
     @property
     def references(self):
-        if self.soup_data is None:
-            return None
-
-        header_tag = self.soup_data.select(self.header_selector)[0]
-        return self.get_references(header_tag)
+        return self._field('references')
 
     @property
     def definitions(self):
-        if self.soup_data is None:
-            return None
-        return [tag.text for tag in self.soup_data.select(self.definitions_selector)]
+        return self._field('definitions')
 
     @property
     def examples(self):
-        if self.soup_data is None:
-            return None
-        return [tag.text for tag in self.soup_data.select(self.examples_selector)]
+        return self._field('examples')
 
     @property
     def phrasal_verbs(self):
-        if self.soup_data is None:
-            return None
+        return self._field('phrasal_verbs')
 
+    def _extract_phrasal_verbs(self, entry_tag):
         phrasal_verbs = []
-        for tag in self.soup_data.select(self.phrasal_verbs_selector):
+        for tag in entry_tag.select(self.phrasal_verbs_selector):
             phrasal_verb = tag.select('.xh')[0].text
             id = self.extract_id(tag.attrs['href'])
 
@@ -299,10 +416,10 @@ class Word:
 
     @property
     def definition_full(self):
-        if self.soup_data is None:
-            return None
+        return self._field('definition_full')
 
-        namespace_tags = self.soup_data.select(self.namespaces_selector)
+    def _extract_definition_full(self, entry_tag, phrasal_verbs):
+        namespace_tags = entry_tag.select(self.namespaces_selector)
 
         info = []
         for namespace_tag in namespace_tags:
@@ -322,12 +439,12 @@ class Word:
 
         if len(info) == 0:
             info.append({'namespace': '__GLOBAL__', 'definitions': []})
-            def_body_tags = self.soup_data.select(self.definition_body_selector)
+            def_body_tags = entry_tag.select(self.definition_body_selector)
             if len(def_body_tags) == 0:
-                def_body_tags = self.soup_data.select(self.definition_body_single_selector)
+                def_body_tags = entry_tag.select(self.definition_body_single_selector)
             if len(def_body_tags) == 0:
                 info[0]['definitions'] = [{
-                    'description': f"As phrasal verb(s) {" and ".join([f"'{pv['name']}'" for pv in self.phrasal_verbs])}",
+                    'description': f"As phrasal verb(s) {" and ".join([f"'{pv['name']}'" for pv in phrasal_verbs])}",
                 }]
                 return info
 
@@ -344,7 +461,10 @@ class Word:
 
     @property
     def idioms(self):
-        idiom_tags = self.soup_data.select(self.idioms_selector)
+        return self._field('idioms')
+
+    def _extract_idioms(self, entry_tag):
+        idiom_tags = entry_tag.select(self.idioms_selector)
 
         idioms = []
         for idiom_tag in idiom_tags:
@@ -401,18 +521,19 @@ class Word:
 
     @property
     def info(self):
-        if self.soup_data is None:
+        entry = self.entry
+        if entry is None:
             return None
 
         word = {
-            'id': self.id,
-            'name': self.name,
-            'wordform': self.wordform,
-            'pronunciations': self.pronunciations,
-            'property': self.property_global,
-            'definitions': self.definition_full,
-            'idioms': self.idioms,
-            'other_results': self.other_results
+            'id': entry.id,
+            'name': entry.name,
+            'wordform': entry.wordform,
+            'pronunciations': entry.pronunciations,
+            'property': entry.property_global,
+            'definitions': entry.definition_full,
+            'idioms': entry.idioms,
+            'other_results': entry.other_results
         }
 
         if not word['property']:
@@ -422,9 +543,95 @@ class Word:
             word.pop('other_results', None)
 
         if word['wordform'] == 'verb':
-            word['phrasal_verbs'] = self.phrasal_verbs
+            word['phrasal_verbs'] = entry.phrasal_verbs
 
-        return word
+        return copy.deepcopy(word)
 
     def __repr__(self):
         return f"Word({self.word}, properties={self.info})"
+
+
+class Transport:
+    """
+    pooled keep-alive http session shared by all word lookups. With a rate limiter that has record() (see
+    throttle.AdaptiveRateLimiter), throttled and failed attempts are retried here instead of inside urllib3, so the
+    limiter sees every response and paces the retries too.
+    """
+    retry_status_codes = (429, 500, 502, 503, 504)
+    retry_exceptions = (requests.Timeout, requests.ConnectionError, requests.exceptions.ChunkedEncodingError)
+
+    def __init__(self, pool_size=10, retries=3, backoff_factor=0.5, timeout=5, rate_limiter=None):
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.retries = retries
+        self.adaptive = hasattr(rate_limiter, "record")
+
+        self.session = requests.Session()
+        self.session.cookies.set_policy(BlockAll())
+        self.session.headers.update({
+            'User-agent': Word.user_agent,
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+
+        retry = Retry(total=0 if self.adaptive else retries, backoff_factor=backoff_factor,
+                      status_forcelist=self.retry_status_codes, allowed_methods=frozenset({'GET'}),
+                      raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry,
+                              pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get(self, url, timer="oxford_fetch_seconds"):
+        """
+        :param timer: histogram for the time of each http request; the time spent waiting for the rate limiter goes
+        to `oxford_rate_wait_seconds`, so a slow server and a tight rate can be told apart
+        """
+        if not self.adaptive:
+            if self.rate_limiter is not None:
+                with metrics.timer("oxford_rate_wait_seconds"):
+                    self.rate_limiter.acquire()
+            with metrics.timer(timer):
+                return self.session.get(url, timeout=self.timeout)
+        for attempt in range(self.retries + 1):
+            with metrics.timer("oxford_rate_wait_seconds"):
+                issued = self.rate_limiter.acquire()
+            try:
+                with metrics.timer(timer):
+                    response = self.session.get(url, timeout=self.timeout)
+            except BaseException as e:
+                # every outcome must be recorded, an unrecorded circuit probe would hold back all other callers
+                self.rate_limiter.record(False, issued)
+                if attempt == self.retries or not isinstance(e, self.retry_exceptions):
+                    raise
+                metrics.increment("oxford_retries_total")
+                continue
+            failed = response.status_code in self.retry_status_codes
+            self.rate_limiter.record(not failed, issued, self._retry_after(response) if failed else None)
+            if not failed or attempt == self.retries:
+                return response
+            metrics.increment("oxford_retries_total")
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            # an http date, or no header
+            return None
+
+    def close(self):
+        self.session.close()
+
+
+_default_transport = None
+_default_transport_lock = threading.Lock()
+
+
+def get_default_transport():
+    """ transport shared by every Word that is not given one explicitly """
+    global _default_transport
+    with _default_transport_lock:
+        if _default_transport is None:
+            _default_transport = Transport()
+        return _default_transport
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class PageCache:
+    """
+    On-disk cache of raw dictionary pages keyed by url.
+    Page bodies are zlib-compressed and stored content-addressed (by sha256), so identical pages reached through
+    different urls (e.g. search and definition url) are stored once. Entries expire after `ttl` seconds and the least
+    recently used ones are evicted once the compressed size exceeds `max_bytes`. In `offline` mode callers must not
+    go to the network on a miss.
+    """
+    batch_size = 200
+
+    def __init__(self, directory="data/page_cache", ttl=None, max_bytes=None, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS pages "
+                             "(url TEXT PRIMARY KEY, digest TEXT NOT NULL, fetched_at REAL, accessed_at REAL)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER NOT NULL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def get(self, url):
+        """ return the cached page bytes for url, or None on a miss or expired entry """
+        with self._lock:
+            row = self._db.execute("SELECT digest, fetched_at FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            digest, fetched_at = row
+            if self.ttl is not None and time.time() - fetched_at > self.ttl:
+                with self._db:
+                    self._remove_url(url, digest)
+                return None
+            try:
+                with open(self._object_path(digest), "rb") as file:
+                    content = zlib.decompress(file.read())
+            except (OSError, zlib.error):
+                with self._db:
+                    self._remove_url(url, digest)
+                return None
+            with self._db:
+                self._db.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            return content
+
+    def put(self, url, content):
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object_path(digest)
+        with self._lock:
+            with self._db:
+                if self._db.execute("SELECT 1 FROM objects WHERE digest = ?", (digest,)).fetchone() is None:
+                    compressed = zlib.compress(content)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path + ".tmp", "wb") as file:
+                        file.write(compressed)
+                    os.replace(path + ".tmp", path)
+                    self._db.execute("INSERT INTO objects (digest, size) VALUES (?, ?)", (digest, len(compressed)))
+                old = self._db.execute("SELECT digest FROM pages WHERE url = ?", (url,)).fetchone()
+                now = time.time()
+                self._db.execute("INSERT OR REPLACE INTO pages (url, digest, fetched_at, accessed_at) "
+                                 "VALUES (?, ?, ?, ?)", (url, digest, now, now))
+                if old is not None and old[0] != digest:
+                    self._drop_object_if_unused(old[0])
+                self._evict()
+
+    def fetched_at(self, url):
+        """ time the page for url was fetched, or None if it is not cached """
+        with self._lock:
+            row = self._db.execute("SELECT fetched_at FROM pages WHERE url = ?", (url,)).fetchone()
+        return row[0] if row is not None else None
+
+    def iter_pages(self):
+        """
+        stream (url, page bytes, fetched at) of every unexpired page, e.g. to build a lexicon from; unreadable pages
+        are skipped. Unlike get, this does not count as a use for eviction.
+        """
+        last_url = ""
+        while True:
+            with self._lock:
+                rows = self._db.execute("SELECT url, digest, fetched_at FROM pages WHERE url > ? ORDER BY url LIMIT ?",
+                                        (last_url, self.batch_size)).fetchall()
+            if not rows:
+                return
+            for url, digest, fetched_at in rows:
+                if self.ttl is not None and time.time() - fetched_at > self.ttl:
+                    continue
+                try:
+                    with open(self._object_path(digest), "rb") as file:
+                        content = zlib.decompress(file.read())
+                except (OSError, zlib.error):
+                    continue
+                yield url, content, fetched_at
+            last_url = rows[-1][0]
+
+    def _remove_url(self, url, digest):
+        self._db.execute("DELETE FROM pages WHERE url = ?", (url,))
+        self._drop_object_if_unused(digest)
+
+    def _drop_object_if_unused(self, digest):
+        if self._db.execute("SELECT 1 FROM pages WHERE digest = ?", (digest,)).fetchone() is not None:
+            return
+        self._db.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+        try:
+            os.remove(self._object_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        if self.max_bytes is None:
+            return
+        total = self._size_bytes()
+        while total > self.max_bytes:
+            row = self._db.execute("SELECT url, digest FROM pages ORDER BY accessed_at LIMIT 1").fetchone()
+            if row is None:
+                break
+            self._remove_url(*row)
+            total = self._size_bytes()
+
+    def _size_bytes(self):
+        return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def size_bytes(self):
+        """ total compressed size of all stored pages """
+        with self._lock:
+            return self._size_bytes()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+
+    def close(self):
+        self._db.close()
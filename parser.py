@@ -1,62 +1,298 @@
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+import hashlib
+import json
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 import logging
+from html.parser import HTMLParser
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+def _is_note_text(class_value):
+    """ the strainer passes the whole class attribute ("noteText extra"), find_all each class on its own """
+    return class_value is not None and "noteText" in class_value.split()
+
+
+class _NoteTextTokenizer(HTMLParser):
+    """
+    incremental tokenizer that collects the text of every <div class="noteText"> in document order as soon as it and
+    all earlier ones are closed. Mirrors BeautifulSoup: stray closing tags (Kindle exports close noteText with </h3>)
+    are ignored, so an unclosed noteText div keeps collecting text, including that of noteText divs nested in it.
+    A note whose cleaned text reaches `max_length` would be dropped by the parser, so it stops collecting and counts
+    as completed; unclosed notes then hold a bounded amount of text and the notes after them are not held back.
+    """
+
+    def __init__(self, max_length, clean):
+        super().__init__(convert_charrefs=True)
+        self.max_length = max_length
+        self.clean = clean
+        self.completed = []
+        self._open_divs = []  # note record of every open div, None for other divs
+        # [text parts or None once too long, closed, cleaned length] of noteText divs not yet completed, in order
+        self._notes = deque()
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "div":
+            return
+        note = None
+        if "noteText" in (dict(attrs).get("class") or "").split():
+            note = [[], False, 0]
+            self._notes.append(note)
+        self._open_divs.append(note)
+
+    def handle_endtag(self, tag):
+        if tag != "div" or not self._open_divs:
+            return
+        note = self._open_divs.pop()
+        if note is not None:
+            note[1] = True
+            self._flush()
+
+    def handle_data(self, data):
+        length = None
+        too_long = False
+        for note in self._notes:
+            if note[1]:
+                continue
+            # cleaning works character by character, so the lengths of the cleaned chunks add up
+            length = len(self.clean(data)) if length is None else length
+            note[2] += length
+            if note[2] >= self.max_length:
+                note[0], note[1] = None, True
+                too_long = True
+            else:
+                note[0].append(data)
+        if too_long:
+            self._flush()
+
+    def _flush(self):
+        while self._notes and self._notes[0][1]:
+            text = self._notes.popleft()[0]
+            if text is not None:
+                self.completed.append("".join(text))
+
+    def close(self):
+        super().close()
+        for note in self._notes:
+            note[1] = True
+        self._flush()
+
+
 class NotesParser:
     MAX_WORD_LENGTH = 25
+    # "stream" for the incremental tokenizer, or a BeautifulSoup tree builder such as "html.parser" or "lxml"
+    HTML_PARSER = "stream"
+    CHUNK_SIZE = 64 * 1024
+    # formats are detected from this many characters at the start of a file
+    SNIFF_SIZE = 64 * 1024
+    APPLE_BOOKS_HEADER = re.compile(r"\d*\.\s[a-zA-Z]*\s\d{4}\s{2}")
+    # (name, test on the file prefix, name of the generator classmethod that yields its words)
+    FORMATS = [
+        ("Kindle HTML export", lambda prefix: "<html" in prefix and "noteText" in prefix, "iter_kindle_html_vocab"),
+        ("Apple Books export", lambda prefix: "\nNOTES FROM\n" in prefix, "iter_apple_books_vocab"),
+    ]
+
+    @classmethod
+    def register_format(cls, name, sniff, parser_name):
+        cls.FORMATS.append((name, sniff, parser_name))
+
     @classmethod
     def parse_kindle_html_vocab(cls, file_path):
+        return list(cls.iter_kindle_html_vocab(file_path))
+
+    @classmethod
+    def iter_kindle_html_vocab(cls, file_path):
+        if cls.HTML_PARSER != "stream":
+            yield from cls._parse_kindle_html_soup(file_path)
+            return
+        tokenizer = _NoteTextTokenizer(cls.MAX_WORD_LENGTH, cls._clean)
+        with open(file_path, 'r', encoding="utf8") as f:
+            for chunk in iter(lambda: f.read(cls.CHUNK_SIZE), ""):
+                tokenizer.feed(chunk)
+                yield from cls._filter_markings(tokenizer.completed)
+                tokenizer.completed.clear()
+        tokenizer.close()
+        yield from cls._filter_markings(tokenizer.completed)
+
+    @classmethod
+    def _parse_kindle_html_soup(cls, file_path):
         with open(file_path, 'r', encoding="utf8") as f:
             html = f.read()
-        bs = BeautifulSoup(html, features="html.parser")
-        markings =  [cls._clean(div.getText()) for div in bs.find_all(name="div", attrs={"class": "noteText"})]
-        return [word for word in markings if len(word) < cls.MAX_WORD_LENGTH]
+        # only materialize the highlight divs, not the whole export
+        bs = BeautifulSoup(html, features=cls.HTML_PARSER,
+                           parse_only=SoupStrainer(name="div", attrs={"class": _is_note_text}))
+        divs = bs.find_all(name="div", attrs={"class": _is_note_text})
+        return list(cls._filter_markings(div.getText() for div in divs))
+
+    @classmethod
+    def _filter_markings(cls, markings):
+        for marking in markings:
+            word = cls._clean(marking)
+            if len(word) < cls.MAX_WORD_LENGTH:
+                yield word
 
     @classmethod
     def parse_apple_books_vocab(cls, file_path):
+        return list(cls.iter_apple_books_vocab(file_path))
+
+    @classmethod
+    def iter_apple_books_vocab(cls, file_path):
         with open(file_path, 'r', encoding="utf8") as f:
-            lines = f.readlines()
-        words = []
-        i = 0
-        while i < len(lines):
-            pattern = r"\d*\.\s[a-zA-Z]*\s\d{4}\s{2}"
-            if re.match(pattern, lines[i]):
-                word = cls._clean(lines[i + 1])
-                if len(word) < cls.MAX_WORD_LENGTH:
-                    words.append(word)
-                    i += 1
-            i += 1
-        return words
+            expect_word = False
+            for line in f:
+                if expect_word:
+                    expect_word = False
+                    word = cls._clean(line)
+                    if len(word) < cls.MAX_WORD_LENGTH:
+                        yield word
+                        continue
+                if cls.APPLE_BOOKS_HEADER.match(line):
+                    expect_word = True
 
     @classmethod
     def parse_any(cls, file_path):
+        return list(cls.iter_any(file_path))
+
+    @classmethod
+    def iter_any(cls, file_path):
         with open(file_path, "r", encoding="utf8") as f:
-            content = f.read()
-        if "<html" in content and "noteText" in content:
-            logger.info(f"Parsing {file_path} as Kindle HTML export")
-            return cls.parse_kindle_html_vocab(file_path)
-        elif "\nNOTES FROM\n" in content:
-            logger.info(f"Parsing {file_path} as Apple Books export")
-            return cls.parse_apple_books_vocab(file_path)
-        else:
-            raise NotImplementedError("This export type is not supported yet.")
-
-    @classmethod
-    def parse_all_in_dir(cls, dir_path):
-        vocab = []
-        for file in glob(f"{dir_path}/*"):
+            prefix = f.read(cls.SNIFF_SIZE)
+        for name, sniff, parser_name in cls.FORMATS:
+            if sniff(prefix):
+                logger.info(f"Parsing {file_path} as {name}")
+                return getattr(cls, parser_name)(file_path)
+        raise NotImplementedError("This export type is not supported yet.")
+
+    @classmethod
+    def parse_all_in_dir(cls, dir_path, manifest_path=None, processes=None):
+        return list(cls.iter_all_in_dir(dir_path, manifest_path, processes))
+
+    @classmethod
+    def iter_all_in_dir(cls, dir_path, manifest_path=None, processes=None):
+        """
+        yield the words of every supported export in dir_path, one file at a time
+        :param manifest_path: optional ParseManifest file; unchanged exports are then served from it and only new or
+            changed ones are parsed. A single changed export is streamed; several are parsed across a process pool
+            of `processes` workers, which is started by this call, before the returned generator is consumed.
+        """
+        files = sorted(glob(f"{dir_path}/*"))
+        if manifest_path is None:
+            return cls._iter_files(files)
+        manifest = ParseManifest(manifest_path)
+        cached = {file: manifest.lookup(file) for file in files}
+        changed = [file for file in files if cached[file] is None]
+        pool = futures = None
+        if len(changed) > 1 and processes != 1:
+            # forked in the caller's thread, e.g. before the pipeline that consumes the words starts its threads
+            pool = ProcessPoolExecutor(processes)
+            futures = {file: pool.submit(_parse_file, file) for file in changed}
+        return cls._iter_with_manifest(files, manifest, cached, pool, futures)
+
+    @classmethod
+    def _iter_files(cls, files):
+        for file in files:
             try:
-                vocab += cls.parse_any(file)
+                yield from cls.iter_any(file)
             except NotImplementedError:
                 logger.warning(f"Skipping file {file} as the type is not supported")
-        return vocab
+
+    @classmethod
+    def _iter_with_manifest(cls, files, manifest, cached, pool, futures):
+        try:
+            for file in files:
+                words = cached[file]
+                if words is not None:
+                    yield from words
+                    continue
+                if futures is not None:
+                    words = futures[file].result()
+                    manifest.update(file, words)
+                    yield from words or []
+                    continue
+                # words are passed on as soon as they are found and collected for the manifest on the way
+                words = []
+                try:
+                    for word in cls.iter_any(file):
+                        words.append(word)
+                        yield word
+                except NotImplementedError:
+                    logger.warning(f"Skipping file {file} as the type is not supported")
+                    words = None
+                manifest.update(file, words)
+            manifest.save(files)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
 
     @classmethod
     def _clean(cls, word:str):
         return re.sub(r"[^a-zØ-öø-ÿ]", "", word.strip().lower())
 
+
+
+def _parse_file(file_path):
+    """ words of one export, or None if the type is not supported """
+    try:
+        return NotesParser.parse_any(file_path)
+    except NotImplementedError:
+        logger.warning(f"Skipping file {file_path} as the type is not supported")
+        return None
+
+
+class ParseManifest:
+    """
+    Remembers the extracted words of every export, keyed by path and validated by size, mtime and content hash.
+    Size and mtime unchanged means the file is not read at all; otherwise the content hash decides.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf8") as file:
+                self.entries = json.load(file)
+
+    @staticmethod
+    def _hash(file_path):
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def lookup(self, file_path):
+        """ cached word list of an unchanged file ([] for unsupported files), or None if it must be parsed """
+        entry = self.entries.get(os.path.abspath(file_path))
+        if entry is None:
+            return None
+        stat = os.stat(file_path)
+        if entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            if entry["size"] != stat.st_size or entry["sha256"] != self._hash(file_path):
+                return None
+            # touched but identical
+            entry["mtime_ns"] = stat.st_mtime_ns
+        return entry["words"] if entry["words"] is not None else []
+
+    def update(self, file_path, words):
+        stat = os.stat(file_path)
+        self.entries[os.path.abspath(file_path)] = {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": self._hash(file_path),
+            "words": words,
+        }
+
+    def save(self, files=None):
+        """ write the manifest atomically, dropping entries of files that no longer exist """
+        if files is not None:
+            keep = {os.path.abspath(file) for file in files}
+            self.entries = {path: entry for path, entry in self.entries.items() if path in keep}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w", encoding="utf8") as file:
+            json.dump(self.entries, file, ensure_ascii=False)
+        os.replace(self.path + ".tmp", self.path)
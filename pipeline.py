@@ -0,0 +1,142 @@
+import logging
+import queue
+import threading
+
+from metrics import metrics
+from oxford import WordNotFound
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.DEBUG)
+
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Streams words through parse -> scrape -> audio -> translate -> persist.
+    Stages run in their own threads and are connected by bounded queues, so dictionary requests, translation
+    requests and parsing overlap while memory stays flat: a full queue blocks the stage feeding it. Every word is
+    persisted as soon as it is translated and words already in the store are skipped, so re-running resumes an
+    interrupted import. A word whose headword entry is already on its way through the pipeline (another inflection)
+    is dropped after scraping, so it is not translated twice.
+    """
+
+    def __init__(self, generator, scrape_workers=4, translate_workers=2, audio_workers=2, queue_size=32):
+        self.generator = generator
+        self.scrape_workers = scrape_workers
+        self.translate_workers = translate_workers
+        self.audio_workers = audio_workers
+        self.queue_size = queue_size
+        self.failed = []
+        # ids of the headwords scraped in this run; another inflection of one of them is not translated again
+        self._claimed = set()
+        self._claimed_lock = threading.Lock()
+
+    def run(self, words):
+        """
+        :param words: iterable of words, e.g. NotesParser.iter_all_in_dir(...); consumed lazily
+        :return: number of words persisted
+        """
+        scrape_queue = queue.Queue(self.queue_size)
+        audio_queue = queue.Queue(self.queue_size)
+        translate_queue = queue.Queue(self.queue_size)
+        persist_queue = queue.Queue(self.queue_size)
+        self.failed = []
+        self._claimed = set()
+        persisted = [0]
+
+        stages = [
+            self._start(1, self._parse, words, scrape_queue),
+            self._start(self.scrape_workers, self._worker, self._scrape, scrape_queue, audio_queue),
+            self._start(self.audio_workers, self._worker, self._fetch_audio, audio_queue, translate_queue),
+            self._start(self.translate_workers, self._worker, self._translate, translate_queue, persist_queue),
+            self._start(1, self._worker, self._persist, persist_queue, None, persisted),
+        ]
+        queues = [scrape_queue, audio_queue, translate_queue, persist_queue]
+        # a stage is finished once all its threads are; then tell every worker of the next stage to stop
+        for index, threads in enumerate(stages):
+            for thread in threads:
+                thread.join()
+            if index < len(queues):
+                for _ in stages[index + 1]:
+                    queues[index].put(_DONE)
+
+        if self.failed:
+            logger.warning(f"{len(self.failed)} words failed and will be retried on the next run: {self.failed}")
+        return persisted[0]
+
+    @staticmethod
+    def _start(count, target, *args):
+        threads = [threading.Thread(target=target, args=args, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _parse(self, words, out_queue):
+        seen = set()
+        for word in words:
+            if word in seen:
+                continue
+            seen.add(word)
+            if self.generator.is_known(word):
+                logger.info(f"Word {word} already in data.")
+                continue
+            out_queue.put(word)
+
+    def _worker(self, handle, in_queue, out_queue, *args):
+        while True:
+            item = in_queue.get()
+            if item is _DONE:
+                return
+            try:
+                # e.g. pipeline_scrape_seconds: time a word spends in each stage
+                with metrics.timer(f"pipeline{handle.__name__}_seconds"):
+                    result = handle(item, *args)
+            except Exception:
+                word = item if isinstance(item, str) else item[0]
+                logger.exception(f"Failed to process {word}")
+                self.failed.append(word)
+                metrics.increment("pipeline_failed_total")
+                continue
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+
+    def _scrape(self, word):
+        logger.info(f"Processing {word}...")
+        try:
+            word_infos = self.generator.scrape_word_family(word)
+        except WordNotFound:
+            logger.warning(f"Word {word} not found in dictionary.")
+            return None
+        if word_infos[0]["word"] in self.generator.data:
+            logger.info(f"Word {word_infos[0]["word"]} already in data.")
+            return None
+        with self._claimed_lock:
+            if word_infos[0]["id"] in self._claimed:
+                logger.info(f"Word {word_infos[0]["word"]} is already being processed.")
+                return None
+            self._claimed.add(word_infos[0]["id"])
+        return word, word_infos
+
+    def _fetch_audio(self, item):
+        word, word_infos = item
+        self.generator.fetch_audio(*word_infos)
+        return word, word_infos
+
+    def _translate(self, item):
+        word, word_infos = item
+        self.generator.populate_definitions(*word_infos)
+        return word, word_infos
+
+    def _persist(self, item, persisted):
+        word, word_infos = item
+        base_word = word_infos[0]["word"]
+        # another inflection of the same headword may have been persisted in the meantime
+        if base_word in self.generator.data:
+            logger.info(f"Word {base_word} already in data.")
+            return None
+        self.generator.data[base_word] = self.generator.build_word_data(word_infos)
+        persisted[0] += 1
+        metrics.increment("pipeline_persisted_total")
+        return None
@@ -0,0 +1,36 @@
+from unittest import mock
+
+import pytest
+
+from anki_generator import AnkiDeckGenerator
+from data_store import VocabStore
+from oxford import WordNotFound
+from page_cache import PageCache
+
+
+def entry(word_id, homograph_ids=()):
+    return {"id": word_id, "word": "game", "homograph_ids": list(homograph_ids)}
+
+
+@pytest.mark.parametrize("homograph_ids", [[], ["game_2"], ["game_2", "game_3"]])
+def test_homographs_after_the_related_entries_index_are_probed(tmp_path, monkeypatch, homograph_ids):
+    monkeypatch.chdir(tmp_path)
+    entries = {f"game_{i}": entry(f"game_{i}") for i in range(2, 5)}
+
+    def scrape(word=None, word_id=None):
+        if word == "game":
+            return entry("game_1", homograph_ids)
+        if word_id not in entries:
+            raise WordNotFound
+        return entries[word_id]
+
+    generator = AnkiDeckGenerator(page_cache=PageCache(offline=True), data_store=VocabStore(legacy_json_path=None))
+    with mock.patch.object(generator, "_scrape", side_effect=scrape) as scraped:
+        word_infos = generator.scrape_word_family("game")
+    assert [info["id"] for info in word_infos] == ["game_1", "game_2", "game_3", "game_4"]
+    # every sibling is fetched once, and the probing stops at the first missing entry
+    assert sorted(call.kwargs.get("word_id") or "" for call in scraped.call_args_list) == \
+        ["", "game_2", "game_3", "game_4", "game_5"]
+    generator.data.close()
+    generator.translation_cache.close()
+    generator.translation_memory.close()
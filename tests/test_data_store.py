@@ -0,0 +1,20 @@
+import json
+import os
+
+from data_store import VocabStore
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures")
+
+
+def test_legacy_json_is_imported_without_entries_outside_the_schema(tmp_path):
+    with open(os.path.join(FIXTURES, "word_data.json"), "r", encoding="utf8") as file:
+        legacy = json.load(file)
+    word = next(iter(legacy))
+    legacy["broken"] = {"ipa": "/ˈbrəʊkən/", "definitions": [{"word_form": "adjective"}]}
+    legacy_path = tmp_path / "data.json"
+    legacy_path.write_text(json.dumps(legacy), encoding="utf8")
+
+    store = VocabStore(str(tmp_path / "data.sqlite"), legacy_json_path=str(legacy_path))
+    assert "broken" not in store
+    assert store[word] == legacy[word]
+    assert len(store) == len(legacy) - 1
@@ -0,0 +1,30 @@
+import copy
+import json
+import os
+
+from anki_generator import AnkiDeckGenerator
+from data_store import VocabStore
+from page_cache import PageCache
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures")
+
+
+def test_word_form_shards_get_distinct_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with open(os.path.join(FIXTURES, "word_data.json"), "r", encoding="utf8") as file:
+        data = next(iter(json.load(file).values()))
+    store = VocabStore(legacy_json_path=None)
+    # the first two only differ in characters that cannot go into a file name
+    for word, word_form in (("first", "noun/verb"), ("second", "noun verb"), ("third", "adjective")):
+        word_data = copy.deepcopy(data)
+        word_data["definitions"][0]["word_form"] = word_form
+        store[word] = word_data
+    generator = AnkiDeckGenerator(page_cache=PageCache(offline=True), data_store=store)
+
+    paths = generator.generate_anki_deck("deck.apkg", shard_by="word_form", processes=1)
+    assert len(set(paths)) == 3
+    assert "deck_adjective.apkg" in paths
+    assert all(os.path.exists(path) for path in paths)
+    store.close()
+    generator.translation_cache.close()
+    generator.translation_memory.close()
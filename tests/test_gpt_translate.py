@@ -0,0 +1,58 @@
+import asyncio
+from unittest import mock
+
+import httpx
+import pytest
+from openai import RateLimitError
+
+from gpt_translate import AsyncTranslator
+
+
+def rate_limit_error(headers):
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "http://stub/v1/chat/completions"))
+    return RateLimitError("rate limited", response=response, body=None)
+
+
+def completion(content, headers=None):
+    raw = mock.Mock(headers=headers or {})
+    raw.parse.return_value = mock.Mock(usage=None, choices=[mock.Mock(message=mock.Mock(content=content))])
+    return raw
+
+
+def translator_with(responses, **kwargs):
+    translator = AsyncTranslator(max_concurrency=1, **kwargs)
+    translator._ensure_client = lambda: None
+    translator._semaphore = asyncio.Semaphore(1)
+    translator._client = mock.Mock()
+    translator._client.chat.completions.with_raw_response.create = mock.AsyncMock(side_effect=responses)
+    translator.limiter.pause = mock.Mock()
+    return translator
+
+
+def test_rate_limit_pause_grows_with_every_attempt_despite_a_short_hint():
+    errors = [rate_limit_error({"retry-after-ms": "10"}) for _ in range(4)]
+    translator = translator_with(errors + [completion("Spiel")])
+    assert asyncio.run(translator.translate_one("game", "", "a game")) == "Spiel"
+    assert [call.args[0] for call in translator.limiter.pause.call_args_list] == [0.5, 1, 2, 4]
+
+
+def test_longer_server_hint_wins():
+    translator = translator_with([rate_limit_error({"retry-after-ms": "7000"}), completion("Spiel")])
+    asyncio.run(translator.translate_one("game", "", "a game"))
+    translator.limiter.pause.assert_called_once_with(7.0)
+
+
+def test_gives_up_after_max_retries():
+    translator = translator_with([rate_limit_error({}) for _ in range(3)], max_retries=2)
+    with pytest.raises(RateLimitError):
+        asyncio.run(translator.translate_one("game", "", "a game"))
+
+
+def test_server_limits_lower_the_configured_ones():
+    headers = {"x-ratelimit-limit-requests": "30", "x-ratelimit-limit-tokens": "100000"}
+    translator = translator_with([rate_limit_error(headers), completion("Spiel")],
+                                 requests_per_minute=500, tokens_per_minute=30000)
+    asyncio.run(translator.translate_one("game", "", "a game"))
+    assert translator.limiter.requests_per_minute == 30
+    # never raised above the configured limit
+    assert translator.limiter.tokens_per_minute == 30000
@@ -0,0 +1,54 @@
+import os
+import time
+from unittest import mock
+
+import requests
+
+from anki_generator import AnkiDeckGenerator
+from lexicon import Lexicon
+from page_cache import PageCache
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures",
+                        "oxford")
+
+
+def curmudgeon_page():
+    with open(os.path.join(FIXTURES, "curmudgeon.html"), "rb") as file:
+        return file.read()
+
+
+def test_entries_older_than_max_age_are_misses(tmp_path):
+    lexicon = Lexicon(str(tmp_path / "lexicon.sqlite"))
+    lexicon.put({"id": "curmudgeon", "word": "curmudgeon"}, word="curmudgeon", fetched_at=time.time() - 120)
+    assert lexicon.get(word="curmudgeon") is not None
+    assert lexicon.get(word="curmudgeon", max_age=300) is not None
+    assert lexicon.get(word="curmudgeon", max_age=60) is None
+    assert lexicon.get(word_id="curmudgeon", max_age=60) is None
+
+
+def test_scrape_refetches_entries_past_the_page_cache_ttl(tmp_path):
+    cache = PageCache(str(tmp_path / "pages"), ttl=60)
+    lexicon = Lexicon(str(tmp_path / "lexicon.sqlite"))
+    lexicon.put({"id": "curmudgeon", "word": "stale"}, word="curmudgeon", fetched_at=time.time() - 120)
+    response = requests.Response()
+    response.status_code = 200
+    response._content = curmudgeon_page()
+    transport = mock.Mock(get=mock.Mock(return_value=response))
+
+    entry = AnkiDeckGenerator.scrape_dictionary(word="curmudgeon", transport=transport, cache=cache, lexicon=lexicon)
+    assert entry["word"] == "curmudgeon"
+    assert transport.get.call_count == 1
+    # the fresh entry carries the page's fetch time and is served from the lexicon again
+    assert AnkiDeckGenerator.scrape_dictionary(word="curmudgeon", transport=transport, cache=cache,
+                                               lexicon=lexicon)["word"] == "curmudgeon"
+    assert transport.get.call_count == 1
+
+
+def test_build_keeps_the_page_fetch_time(tmp_path):
+    cache = PageCache(str(tmp_path / "pages"))
+    with mock.patch("page_cache.time.time", return_value=time.time() - 1000):
+        cache.put("https://www.oxfordlearnersdictionaries.com/search/english/direct/?q=curmudgeon", curmudgeon_page())
+    lexicon = Lexicon(str(tmp_path / "lexicon.sqlite"))
+    assert lexicon.build(cache, processes=1) == 1
+    assert lexicon.get(word="curmudgeon", max_age=2000) is not None
+    assert lexicon.get(word="curmudgeon", max_age=500) is None
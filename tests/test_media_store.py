@@ -0,0 +1,28 @@
+import os
+import threading
+from unittest import mock
+
+from media_store import MediaStore
+
+
+def test_urls_with_the_same_recording_download_concurrently(tmp_path):
+    barrier = threading.Barrier(2)
+
+    def get(url, timer=None):
+        # both downloads write their file at the same time
+        barrier.wait(2)
+        return mock.Mock(status_code=200, content=b"recording")
+
+    store = MediaStore(str(tmp_path), transport=mock.Mock(get=get))
+    filenames = {}
+    threads = [threading.Thread(target=lambda url=url: filenames.update({url: store.fetch(url)}))
+               for url in ("http://example.invalid/a.mp3", "http://example.invalid/b.mp3?x=1")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(filenames.values())) == 1
+    filename = filenames["http://example.invalid/a.mp3"]
+    assert (tmp_path / filename).read_bytes() == b"recording"
+    assert sorted(os.listdir(tmp_path)) == sorted([filename, "index.sqlite"])
+    store.close()
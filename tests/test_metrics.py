@@ -0,0 +1,25 @@
+import pstats
+import threading
+
+from metrics import profiled
+
+
+def busy():
+    total = 0
+    for i in range(2_000_000):
+        total += i * i
+    return total
+
+
+def test_profile_covers_worker_threads(tmp_path):
+    path = tmp_path / "profile.pstats"
+    with profiled(str(path)) as report:
+        thread = threading.Thread(target=busy)
+        thread.start()
+        thread.join()
+    stats = pstats.Stats(str(path)).stats
+    busy_stats = next(value for (file_name, _, name), value in stats.items()
+                      if name == "busy" and file_name == __file__)
+    # cumulative time of the function that only ran in the worker thread
+    assert busy_stats[3] > 0
+    assert "busy" in report.getvalue()
@@ -0,0 +1,36 @@
+import os
+from unittest import mock
+
+import pytest
+import requests
+
+from oxford import Word
+from page_cache import PageCache
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks", "fixtures",
+                        "oxford")
+
+
+def response(status_code, content=b""):
+    result = requests.Response()
+    result.status_code = status_code
+    result._content = content
+    return result
+
+
+@pytest.mark.parametrize("status_code", [429, 500, 503])
+def test_error_pages_are_neither_parsed_nor_cached(tmp_path, status_code):
+    cache = PageCache(str(tmp_path / "pages"))
+    transport = mock.Mock(get=mock.Mock(return_value=response(status_code, b"<html>Service Unavailable</html>")))
+    with pytest.raises(requests.HTTPError):
+        Word("curmudgeon", transport=transport, cache=cache)
+    assert len(cache) == 0
+
+
+def test_entries_are_cached(tmp_path):
+    with open(os.path.join(FIXTURES, "curmudgeon.html"), "rb") as file:
+        page = file.read()
+    cache = PageCache(str(tmp_path / "pages"))
+    transport = mock.Mock(get=mock.Mock(return_value=response(200, page)))
+    assert Word("curmudgeon", transport=transport, cache=cache).name == "curmudgeon"
+    assert cache.get(Word.base_url + "/search/english/direct/?q=curmudgeon") == page
@@ -0,0 +1,85 @@
+import os
+import tracemalloc
+
+from parser import NotesParser, ParseManifest
+
+
+def write_apple_books_export(path, words):
+    with open(path, "w", encoding="utf8") as file:
+        file.write("Excerpts From\nA Book\nJane Doe\n\nNOTES FROM\nA Book\nJane Doe\n\n")
+        for i, word in enumerate(words):
+            file.write(f"{i + 1}. October 2023  \n{word}\n\n")
+
+
+def test_manifest_paths_yield_the_same_words(tmp_path):
+    sources = tmp_path / "sources"
+    sources.mkdir()
+    write_apple_books_export(sources / "a.txt", ["curmudgeon", "beaver"])
+    write_apple_books_export(sources / "b.txt", ["game", "ran"])
+    (sources / "c.bin").write_text("not an export")
+    manifest = str(tmp_path / "manifest.json")
+    expected = ["curmudgeon", "beaver", "game", "ran"]
+
+    # several changed files: process pool
+    assert list(NotesParser.iter_all_in_dir(str(sources), manifest, processes=2)) == expected
+    # nothing changed: served from the manifest
+    assert list(NotesParser.iter_all_in_dir(str(sources), manifest)) == expected
+    # one changed file: streamed
+    write_apple_books_export(sources / "b.txt", ["game", "laconic"])
+    assert list(NotesParser.iter_all_in_dir(str(sources), manifest)) == ["curmudgeon", "beaver", "game", "laconic"]
+    assert ParseManifest(manifest).entries[os.path.abspath(sources / "b.txt")]["words"] == ["game", "laconic"]
+
+
+def test_single_changed_export_is_streamed(tmp_path):
+    sources = tmp_path / "sources"
+    sources.mkdir()
+    write_apple_books_export(sources / "a.txt", ["curmudgeon", "beaver"])
+    manifest = str(tmp_path / "manifest.json")
+    words = NotesParser.iter_all_in_dir(str(sources), manifest)
+    assert next(words) == "curmudgeon"
+    # the first word arrives before the export is finished and recorded
+    assert not os.path.exists(manifest)
+    assert list(words) == ["beaver"]
+    assert os.path.exists(manifest)
+
+
+def test_soup_parser_reads_note_text_divs_with_several_classes(tmp_path, monkeypatch):
+    path = tmp_path / "export.html"
+    path.write_text('<html><body><div class="noteHeading">Highlight (yellow) - Page 3</div>'
+                    '<div class="noteText extra">curmudgeon</div>'
+                    '<div class="noteText">beaver</div></body></html>', encoding="utf8")
+    monkeypatch.setattr(NotesParser, "HTML_PARSER", "html.parser")
+    assert list(NotesParser.iter_any(str(path))) == ["curmudgeon", "beaver"]
+    monkeypatch.setattr(NotesParser, "HTML_PARSER", "stream")
+    assert list(NotesParser.iter_any(str(path))) == ["curmudgeon", "beaver"]
+
+
+def write_unclosed_kindle_export(path, words):
+    # Kindle closes every noteText div with a stray </h3>, so each one stays open until the end of the file
+    with open(path, "w", encoding="utf8") as file:
+        file.write('<html><head><meta charset="UTF-8" /></head><body><div class="bodyContainer">\n')
+        for i, word in enumerate(words):
+            file.write(f'<div class="noteHeading">Highlight (yellow) - Location {i}</div>\n'
+                       f'<div class="noteText">{word}\n</h3>\n')
+        file.write("</div></body></html>\n")
+
+
+def test_unclosed_note_text_divs_match_the_soup_parser(tmp_path, monkeypatch):
+    path = tmp_path / "export.html"
+    write_unclosed_kindle_export(path, [f"word{chr(97 + i % 26)}" for i in range(300)] + ["laconic"])
+    streamed = list(NotesParser.iter_any(str(path)))
+    monkeypatch.setattr(NotesParser, "HTML_PARSER", "html.parser")
+    assert streamed == list(NotesParser.iter_any(str(path)))
+
+
+def test_unclosed_note_text_divs_take_bounded_memory(tmp_path):
+    path = tmp_path / "export.html"
+    write_unclosed_kindle_export(path, ["curmudgeon"] * 4000)
+    tracemalloc.start()
+    try:
+        words = list(NotesParser.iter_any(str(path)))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert words == ["curmudgeon"]
+    assert peak < 2 * 2 ** 20
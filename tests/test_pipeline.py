@@ -0,0 +1,38 @@
+import threading
+
+from pipeline import Pipeline
+
+
+class FakeGenerator:
+    """ every inflection of run resolves to the entry run_1 """
+
+    def __init__(self):
+        self.data = {}
+        self.translated = []
+        self._scraped = threading.Barrier(3)
+
+    def is_known(self, word):
+        return False
+
+    def scrape_word_family(self, word):
+        # all inflections are scraped before any of them is persisted
+        self._scraped.wait(5)
+        return [{"id": "run_1", "word": "run"}] if word != "game" else [{"id": "game_1", "word": "game"}]
+
+    def fetch_audio(self, *word_infos):
+        pass
+
+    def populate_definitions(self, *word_infos):
+        self.translated.append(word_infos[0]["id"])
+
+    @staticmethod
+    def build_word_data(word_infos):
+        return {"id": word_infos[0]["id"]}
+
+
+def test_inflections_of_one_headword_are_translated_once():
+    generator = FakeGenerator()
+    persisted = Pipeline(generator, scrape_workers=3).run(["ran", "runs", "game"])
+    assert persisted == 2
+    assert sorted(generator.translated) == ["game_1", "run_1"]
+    assert set(generator.data) == {"run", "game"}
@@ -0,0 +1,135 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from metrics import metrics
+from oxford import Transport
+from throttle import AdaptiveRateLimiter
+
+
+def limiter(**kwargs):
+    options = dict(rate=10.0, min_rate=0.1, max_rate=100.0, failure_threshold=3, open_seconds=0.05,
+                   max_open_seconds=1.0, probe_timeout=0.2)
+    options.update(kwargs)
+    return AdaptiveRateLimiter(**options)
+
+
+def test_slow_start_adds_one_per_success_until_the_first_failure():
+    rate_limiter = limiter()
+    rate_limiter.record(True)
+    assert rate_limiter.rate == pytest.approx(11)
+    rate_limiter.record(False)
+    assert rate_limiter.rate == pytest.approx(11 * 0.7)
+    rate_limiter.record(True)
+    assert rate_limiter.rate == pytest.approx(7.7 + 1 / 7.7)
+
+
+def test_rate_stays_within_bounds():
+    rate_limiter = limiter(rate=1.0, min_rate=0.5, max_rate=2.0)
+    for _ in range(5):
+        rate_limiter.record(True)
+    assert rate_limiter.rate == 2.0
+    rate_limiter.record(False, issued=rate_limiter.acquire())
+    assert rate_limiter.rate == pytest.approx(1.4)
+    for _ in range(3):
+        rate_limiter.record(False, issued=rate_limiter.acquire())
+    assert rate_limiter.rate == 0.5
+
+
+def test_one_cut_per_window_of_in_flight_requests():
+    rate_limiter = limiter()
+    issued = [rate_limiter.acquire() for _ in range(3)]
+    for slot in issued:
+        rate_limiter.record(False, issued=slot)
+    # all three were in flight before the first cut
+    assert rate_limiter.rate == pytest.approx(7)
+    rate_limiter.record(False, issued=rate_limiter.acquire())
+    assert rate_limiter.rate == pytest.approx(4.9)
+
+
+def test_retry_after_holds_back_the_next_slot():
+    rate_limiter = limiter(rate=100.0)
+    rate_limiter.record(False, retry_after=0.1)
+    start = time.monotonic()
+    rate_limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_circuit_opens_probes_and_closes():
+    rate_limiter = limiter()
+    for _ in range(3):
+        rate_limiter.record(False, issued=rate_limiter.acquire())
+    assert rate_limiter.state == "open"
+    start = time.monotonic()
+    probe = rate_limiter.acquire()
+    assert time.monotonic() - start >= 0.04
+    assert rate_limiter.state == "half_open"
+    rate_limiter.record(True, issued=probe)
+    assert rate_limiter.state == "closed"
+
+
+def test_failed_probe_reopens_for_twice_as_long():
+    rate_limiter = limiter()
+    for _ in range(3):
+        rate_limiter.record(False, issued=rate_limiter.acquire())
+    rate_limiter.record(False, issued=rate_limiter.acquire())
+    assert rate_limiter.state == "open"
+    start = time.monotonic()
+    rate_limiter.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def test_half_open_reopens_when_the_probe_never_reports():
+    rate_limiter = limiter()
+    for _ in range(3):
+        rate_limiter.record(False, issued=rate_limiter.acquire())
+    rate_limiter.acquire()
+    assert rate_limiter.state == "half_open"
+    # the probe is lost; the next caller must still get through after the deadline and the reopened circuit
+    start = time.monotonic()
+    rate_limiter.acquire()
+    assert rate_limiter.state == "half_open"
+    assert 0.2 <= time.monotonic() - start < 1.0
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.ChunkedEncodingError, requests.TooManyRedirects, ValueError])
+def test_transport_records_every_failed_probe(error):
+    rate_limiter = limiter(failure_threshold=1)
+    rate_limiter.record(False, issued=rate_limiter.acquire())
+    transport = Transport(retries=0, rate_limiter=rate_limiter)
+    with mock.patch.object(transport.session, "get", side_effect=error("boom")):
+        with pytest.raises(error):
+            transport.get("http://example.invalid/")
+    assert rate_limiter.state == "open"
+    # a waiting caller is let through as the next probe instead of hanging
+    done = threading.Event()
+    threading.Thread(target=lambda: (rate_limiter.acquire(), done.set()), daemon=True).start()
+    assert done.wait(2)
+
+
+def test_transport_retries_throttled_responses_and_reports_them():
+    rate_limiter = limiter()
+    transport = Transport(retries=2, rate_limiter=rate_limiter)
+    throttled = mock.Mock(status_code=429, headers={"Retry-After": "0"})
+    ok = mock.Mock(status_code=200, headers={})
+    with mock.patch.object(transport.session, "get", side_effect=[throttled, ok]) as get:
+        assert transport.get("http://example.invalid/") is ok
+    assert get.call_count == 2
+    assert rate_limiter.rate == pytest.approx(10 * 0.7 + 1 / 7)
+
+
+def test_transport_times_the_request_apart_from_the_rate_limiter_wait():
+    metrics.reset()
+    rate_limiter = limiter()
+    transport = Transport(retries=0, rate_limiter=rate_limiter)
+    ok = mock.Mock(status_code=200, headers={})
+    with mock.patch.object(rate_limiter, "acquire", side_effect=lambda: time.sleep(0.2)), \
+            mock.patch.object(transport.session, "get", return_value=ok):
+        transport.get("http://example.invalid/", timer="media_fetch_seconds")
+    histograms = metrics.to_dict()["histograms"]
+    assert histograms["oxford_rate_wait_seconds"]["sum"] >= 0.2
+    assert histograms["media_fetch_seconds"]["sum"] < 0.1
+    assert "oxford_fetch_seconds" not in histograms
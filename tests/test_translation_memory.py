@@ -0,0 +1,70 @@
+import pytest
+
+from translation_cache import TranslationCache
+from translation_memory import TranslationMemory, ngrams, similarity
+
+DEFINITION = "a person, especially an old one, who is often bad-tempered and annoyed"
+SIMILAR = "a person, especially an old one, who is often bad-tempered and annoyed."
+
+
+def memory(tmp_path, threshold=0.8, max_entries=None):
+    cache = TranslationCache(str(tmp_path / "translations.sqlite"), version="v1", max_entries=max_entries)
+    return TranslationMemory(cache, str(tmp_path / "memory.sqlite"), threshold=threshold)
+
+
+def test_similarity_of_trigrams():
+    assert similarity(ngrams("Game  Over"), ngrams("game over")) == 1.0
+    assert similarity(ngrams(DEFINITION), ngrams(SIMILAR)) >= 0.8
+    assert similarity(ngrams("a game"), ngrams("an animal")) < 0.3
+
+
+@pytest.mark.parametrize("threshold", [0, -0.5, 1.5])
+def test_threshold_outside_zero_to_one_is_rejected(tmp_path, threshold):
+    with pytest.raises(ValueError):
+        memory(tmp_path, threshold=threshold)
+
+
+def test_similar_definition_of_the_same_word_reuses_the_translation(tmp_path):
+    translation_memory = memory(tmp_path)
+    translation_memory.put("curmudgeon", "noun", DEFINITION, "der Griesgram")
+    assert translation_memory.get("curmudgeon", "noun", SIMILAR) == "der Griesgram"
+    # another headword or context is never matched
+    assert translation_memory.get("grouch", "noun", SIMILAR) is None
+    assert translation_memory.get("curmudgeon", "verb", SIMILAR) is None
+    assert translation_memory.get("curmudgeon", "noun", "a small animal with a flat tail") is None
+    assert translation_memory.stats == {"avoided_translations": 1, "misses": 3, "hit_rate": 0.25}
+
+
+def test_fuzzy_hits_become_exact_cache_entries(tmp_path):
+    translation_memory = memory(tmp_path)
+    translation_memory.put("curmudgeon", "noun", DEFINITION, "der Griesgram")
+    translation_memory.get("curmudgeon", "noun", SIMILAR)
+    assert translation_memory.cache.get("curmudgeon", "noun", SIMILAR) == "der Griesgram"
+    translation_memory.get("curmudgeon", "noun", SIMILAR)
+    assert translation_memory.hits == 1
+
+
+def test_translate_sends_one_of_several_similar_definitions(tmp_path):
+    translation_memory = memory(tmp_path)
+    sent = []
+
+    def translate(items, cache):
+        sent.extend(items)
+        return [f"translation {i}" for i in range(len(items))]
+
+    items = [("curmudgeon", "noun", DEFINITION), ("curmudgeon", "noun", SIMILAR),
+             ("curmudgeon", "noun", "a small animal with a flat tail")]
+    assert translation_memory.translate(items, translate) == ["translation 0", "translation 0", "translation 1"]
+    assert sent == [items[0], items[2]]
+    assert translation_memory.hits == 1
+    assert translation_memory.cache.get(*items[1]) == "translation 0"
+
+
+def test_memory_keeps_at_most_the_cache_max_entries(tmp_path):
+    translation_memory = memory(tmp_path, max_entries=2)
+    for i, definition in enumerate(["the first sense", "the second sense", "the third sense"]):
+        translation_memory.put(f"word{i}", "noun", definition, f"Wort {i}")
+    translation_memory.put("word2", "noun", "the third sense", "Wort 2")
+    assert len(translation_memory) == 2
+    assert translation_memory.match("word0", "noun", "the first sense") is None
+    assert translation_memory.match("word2", "noun", "the third sense") == ("Wort 2", 1.0)
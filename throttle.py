@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+
+from metrics import metrics
+
+
+class RateLimiter:
+    """ thread-safe limiter that spaces calls to at most `rate` per second across all threads """
+
+    def __init__(self, rate=1.0):
+        if rate <= 0:
+            raise ValueError("rate must be positive.")
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self):
+        """ block until the caller may issue its next request; :return: the monotonic time of its slot """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.rate
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+        return slot
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    RateLimiter that finds the highest rate the server sustains (AIMD). Callers report every response via
+    record(). Until the first failure, each success raises the rate by one, doubling it about every second (slow
+    start). After that, each success raises it by `increase` / rate, i.e. by about `increase` requests per second
+    every second. A throttled or failed request (429, 5xx, timeout) multiplies it by `decrease`, at most once for
+    all requests issued before the previous cut, and a Retry-After holds back the next slot.
+
+    After `failure_threshold` failures in a row the circuit opens: acquire() blocks for `open_seconds`, then
+    lets a single probe request through. If the probe succeeds the circuit closes again; if it fails, or its
+    outcome is not recorded within `probe_timeout` seconds, the circuit stays open for twice as long (up to
+    `max_open_seconds`). Blocking instead of failing fast pauses the
+    pipeline during an outage instead of failing every word in it. Rate and circuit state are published as
+    `<name>_...` metrics.
+    """
+
+    def __init__(self, rate=1.0, min_rate=0.1, max_rate=20.0, increase=1.0, decrease=0.7, failure_threshold=5,
+                 open_seconds=30.0, max_open_seconds=300.0, probe_timeout=60.0, name="oxford"):
+        if not 0 < min_rate <= rate <= max_rate:
+            raise ValueError("rate must lie between min_rate and max_rate.")
+        super().__init__(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.probe_timeout = probe_timeout
+        self.name = name
+        self.state = "closed"
+        self._slow_start = True
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._probe_deadline = 0.0
+        self._next_open_seconds = open_seconds
+        self._last_decrease = float("-inf")
+        metrics.set_gauge(f"{name}_rate_per_second", rate)
+        metrics.set_gauge(f"{name}_circuit_open", 0)
+
+    def acquire(self):
+        # unlike RateLimiter, slots are not booked ahead: waiting callers take them one at a time as they come
+        # due, so a changed rate applies to everybody who is still waiting
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self.state == "half_open" and now >= self._probe_deadline:
+                    # the probe's outcome never arrived; count it as failed
+                    self._open(now)
+                if self.state == "open" and now >= self._open_until:
+                    # half-open: this caller sends the probe, everybody else keeps waiting for its outcome
+                    self.state = "half_open"
+                    self._probe_deadline = now + self.probe_timeout
+                    return self._take_slot(now)
+                if self.state == "closed" and now >= self._next_slot:
+                    return self._take_slot(now)
+                if self.state == "open":
+                    wait = self._open_until - now
+                elif self.state == "closed":
+                    wait = self._next_slot - now
+                else:
+                    wait = min(1 / self.rate, self._probe_deadline - now)
+            time.sleep(wait)
+
+    def _take_slot(self, now):
+        # a late wake-up may catch up by at most one interval
+        self._next_slot = max(self._next_slot, now - 1 / self.rate) + 1 / self.rate
+        return now
+
+    def record(self, success, issued=None, retry_after=None):
+        """
+        report the outcome of a request
+        :param issued: the slot acquire() returned for it; failures of requests issued before the last cut do not
+            cut again
+        :param retry_after: seconds the server asked to wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            if success:
+                self._consecutive_failures = 0
+                if self.state != "closed":
+                    self._close()
+                self.rate = min(self.max_rate, self.rate + (1 if self._slow_start else self.increase / self.rate))
+            else:
+                self._consecutive_failures += 1
+                metrics.increment(f"{self.name}_throttled_total")
+                self._slow_start = False
+                if issued is None or issued >= self._last_decrease:
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    self._last_decrease = now
+                    metrics.increment(f"{self.name}_rate_decreases_total")
+                if retry_after:
+                    self._next_slot = max(self._next_slot, now + retry_after)
+                if self.state == "half_open" or (self.state == "closed" and
+                                                 self._consecutive_failures >= self.failure_threshold):
+                    self._open(now)
+            metrics.set_gauge(f"{self.name}_rate_per_second", self.rate)
+
+    def _open(self, now):
+        self.state = "open"
+        self._open_until = now + self._next_open_seconds
+        self._next_open_seconds = min(self.max_open_seconds, self._next_open_seconds * 2)
+        metrics.increment(f"{self.name}_circuit_opens_total")
+        metrics.set_gauge(f"{self.name}_circuit_open", 1)
+
+    def _close(self):
+        self.state = "closed"
+        self._next_open_seconds = self.open_seconds
+        metrics.set_gauge(f"{self.name}_circuit_open", 0)
+
+
+class AsyncRequestTokenLimiter:
+    """
+    token buckets for requests and tokens per minute, shared by all coroutines of one event loop.
+    Both buckets refill continuously; a request waits until it fits into both. The server's view
+    (remaining-request/token headers, 429 retry hints) can be fed back via update() and pause().
+    """
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=30000):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute / 60)
+        return now
+
+    async def acquire(self, tokens):
+        """ wait until one request with an estimated `tokens` tokens may be sent """
+        tokens = min(tokens, self.tokens_per_minute)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = self._refill()
+                wait = max(0.0, self._blocked_until - now,
+                           (1 - self._requests) * 60 / self.requests_per_minute,
+                           (tokens - self._tokens) * 60 / self.tokens_per_minute)
+                if wait <= 0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep(wait)
+
+    def adjust(self, tokens):
+        """ correct the token bucket by the difference between estimated and actually used tokens """
+        self._tokens -= tokens
+
+    def update(self, remaining_requests=None, remaining_tokens=None):
+        """ never assume more capacity than the server reports """
+        self._refill()
+        if remaining_requests is not None:
+            self._requests = min(self._requests, remaining_requests)
+        if remaining_tokens is not None:
+            self._tokens = min(self._tokens, remaining_tokens)
+
+    def lower_limits(self, requests_per_minute=None, tokens_per_minute=None):
+        """ adopt the server's limits (x-ratelimit-limit-* headers) where they are lower than the configured ones """
+        self._refill()
+        if requests_per_minute is not None and requests_per_minute < self.requests_per_minute:
+            self.requests_per_minute = requests_per_minute
+            self._requests = min(self._requests, requests_per_minute)
+        if tokens_per_minute is not None and tokens_per_minute < self.tokens_per_minute:
+            self.tokens_per_minute = tokens_per_minute
+            self._tokens = min(self._tokens, tokens_per_minute)
+
+    def pause(self, seconds):
+        """ hold back every request for `seconds`, e.g. after a 429 response """
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
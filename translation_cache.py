@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+
+
+class TranslationCache:
+    """
+    Durable cache of (word, context, definition) -> german translation.
+    Keys are hashes of the normalized inputs and a version string (model and prompt), so changing either
+    invalidates old answers. Once more than `max_entries` translations are stored the least recently used are evicted.
+    """
+
+    def __init__(self, path="data/translations.sqlite", version="", max_entries=None):
+        self.version = version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS translations "
+                             "(key TEXT PRIMARY KEY, translation TEXT NOT NULL, used_at REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS translations_used_at ON translations (used_at)")
+        self._size = self._db.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+
+    @staticmethod
+    def _normalize(text):
+        return " ".join((text or "").split()).lower()
+
+    def key(self, word, context, definition):
+        normalized = [self.version] + [self._normalize(part) for part in (word, context, definition)]
+        return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode("utf8")).hexdigest()
+
+    def get(self, word, context, definition):
+        key = self.key(word, context, definition)
+        with self._lock:
+            row = self._db.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.increment("translation_cache_misses_total")
+                return None
+            self.hits += 1
+            metrics.increment("translation_cache_hits_total")
+            with self._db:
+                self._db.execute("UPDATE translations SET used_at = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, word, context, definition, translation):
+        key = self.key(word, context, definition)
+        with self._lock, self._db:
+            exists = self._db.execute("SELECT 1 FROM translations WHERE key = ?", (key,)).fetchone() is not None
+            self._db.execute("INSERT OR REPLACE INTO translations (key, translation, used_at) VALUES (?, ?, ?)",
+                             (key, translation, time.time()))
+            if not exists:
+                self._size += 1
+            if self.max_entries is not None and self._size > self.max_entries:
+                self._db.execute("DELETE FROM translations WHERE key IN "
+                                 "(SELECT key FROM translations ORDER BY used_at LIMIT ?)",
+                                 (self._size - self.max_entries,))
+                self._size = self.max_entries
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": self._size,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        return self._size
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+
+from metrics import metrics
+
+
+def ngrams(text, n=3):
+    """ character n-grams of the normalized text, padded so that short words count too """
+    text = f" {' '.join((text or '').split()).lower()} "
+    return {text[i:i + n] for i in range(max(1, len(text) - n + 1))}
+
+
+def similarity(a, b):
+    """ Jaccard similarity of two n-gram sets """
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class TranslationMemory:
+    """
+    Fuzzy layer over a TranslationCache. A definition whose description differs from an already translated one of
+    the same word and context by a few words (similarity of their character trigrams >= `threshold`) gets the
+    stored translation instead of a new request. Only the same word is matched: the translation is the german
+    equivalent of the word, so it cannot be carried over to another headword with a similar definition.
+
+    It has the cache's get/put interface, so it can be passed as `cache` to the translators. A reused translation
+    is also put into the cache, so the next lookup of that definition is an exact hit. The memory keeps at most the
+    cache's `max_entries` definitions, dropping the least recently stored.
+    """
+
+    def __init__(self, cache, path="data/translation_memory.sqlite", threshold=0.8):
+        if not 0 < threshold <= 1:
+            raise ValueError("threshold must lie above 0 and at most 1.")
+        self.cache = cache
+        self.threshold = threshold
+        # every hit is a definition that was not sent to the model
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS memory (version TEXT NOT NULL, word TEXT NOT NULL, "
+                             "context TEXT NOT NULL, definition TEXT NOT NULL, translation TEXT NOT NULL, "
+                             "PRIMARY KEY (version, word, context, definition))")
+        self._size = self._db.execute("SELECT COUNT(*) FROM memory").fetchone()[0]
+
+    @staticmethod
+    def _normalize(text):
+        return " ".join((text or "").split()).lower()
+
+    def match(self, word, context, definition):
+        """ (translation, similarity) of the most similar stored definition above the threshold, or None """
+        with self._lock:
+            rows = self._db.execute("SELECT definition, translation FROM memory "
+                                    "WHERE version = ? AND word = ? AND context = ?",
+                                    (self.cache.version, self._normalize(word), self._normalize(context))).fetchall()
+        grams = ngrams(definition)
+        best = None
+        for stored_definition, translation in rows:
+            score = similarity(grams, ngrams(stored_definition))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = translation, score
+        return best
+
+    def get(self, word, context, definition):
+        translation = self.cache.get(word, context, definition)
+        if translation is not None:
+            return translation
+        match = self.match(word, context, definition)
+        with self._lock:
+            if match is None:
+                self.misses += 1
+                metrics.increment("translation_memory_misses_total")
+                return None
+            self.hits += 1
+            metrics.increment("translation_memory_hits_total")
+        self.cache.put(word, context, definition, match[0])
+        return match[0]
+
+    def put(self, word, context, definition, translation):
+        self.cache.put(word, context, definition, translation)
+        key = self.cache.version, self._normalize(word), self._normalize(context), self._normalize(definition)
+        with self._lock, self._db:
+            exists = self._db.execute("SELECT 1 FROM memory WHERE version = ? AND word = ? AND context = ? "
+                                      "AND definition = ?", key).fetchone() is not None
+            # a replaced row gets a new rowid, so rowid order is the order in which definitions were stored
+            self._db.execute("INSERT OR REPLACE INTO memory (version, word, context, definition, translation) "
+                             "VALUES (?, ?, ?, ?, ?)", key + (translation,))
+            if not exists:
+                self._size += 1
+            max_entries = self.cache.max_entries
+            if max_entries is not None and self._size > max_entries:
+                self._db.execute("DELETE FROM memory WHERE rowid IN (SELECT rowid FROM memory ORDER BY rowid LIMIT ?)",
+                                 (self._size - max_entries,))
+                self._size = max_entries
+
+    def translate(self, items, translate):
+        """
+        translate (word, context, definition) items with translate(items, cache=self), sending only the first of
+        several similar definitions of the same word within items; the others get its translation
+        """
+        leaders, sources, grams = [], {}, {}
+        for i, (word, context, definition) in enumerate(items):
+            key = self._normalize(word), self._normalize(context)
+            grams[i] = ngrams(definition)
+            source = next((j for j in leaders if (self._normalize(items[j][0]), self._normalize(items[j][1])) == key
+                           and similarity(grams[i], grams[j]) >= self.threshold), None)
+            if source is None:
+                leaders.append(i)
+            else:
+                sources[i] = source
+        translations = dict(zip(leaders, translate([items[i] for i in leaders], cache=self)))
+        for i, source in sources.items():
+            translations[i] = translations[source]
+            self.cache.put(*items[i], translations[i])
+        if sources:
+            with self._lock:
+                self.hits += len(sources)
+            metrics.increment("translation_memory_hits_total", len(sources))
+        return [translations[i] for i in range(len(items))]
+
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"avoided_translations": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM memory WHERE version = ?",
+                                    (self.cache.version,)).fetchone()[0]
+
+    def close(self):
+        self._db.close()